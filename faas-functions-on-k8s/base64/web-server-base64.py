@@ -1,5 +1,9 @@
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
 import base64
+import binascii
+
+import function_aio
+import function_runtime
 
 def base64py():
     STR_SIZE = 1000000
@@ -19,33 +23,89 @@ def base64py():
     
     return result
 
-class FunctionServer(BaseHTTPRequestHandler):
+# input bytes per chunk: a multiple of 3 so encoded chunks join without padding
+CHUNK_SIZE = 3 * 64 * 1024
+WHITESPACE = b" \t\r\n"
+
+def base64_encode_stream(chunks):
+    # every chunk except the last must be a multiple of 3 bytes long
+    for chunk in chunks:
+        yield binascii.b2a_base64(chunk, newline=False)
+
+def base64_decode_stream(chunks):
+    # carry incomplete 4-character groups over to the next chunk
+    pending = b""
+    for chunk in chunks:
+        data = bytes(chunk).translate(None, WHITESPACE)
+        if pending:
+            data = pending + data
+        usable = len(data) - len(data) % 4
+        if usable:
+            yield binascii.a2b_base64(memoryview(data)[:usable])
+        pending = data[usable:]
+    if pending:
+        yield binascii.a2b_base64(pending)
+
+STREAMS = {
+    'encode': (base64_encode_stream, "text/plain"),
+    'decode': (base64_decode_stream, "application/octet-stream"),
+}
+
+class FunctionServer(function_runtime.FunctionHandler):
+    function_name = "base64"
+
+    @classmethod
+    def warm_up(cls):
+        list(base64_decode_stream(base64_encode_stream([b"warm up"])))
+
     def do_GET(self):
         # inherited from BaseHTTPRequestHandler 
-        # execute the function
-        result = base64py()
+        # execute the function; the result never changes, so it can be memoized
+        self.send_memoized(base64py, paragraphs=lambda result: [
+            "Encoded: %s" % result['s_encode'], "Decoded: %s" % result['s_decode']])
+
+    def do_POST(self):
+        # stream the request body through base64: ?op=encode (default) or ?op=decode
+        op = parse_qs(urlparse(self.path).query).get('op', ['encode'])[0]
+        if op not in STREAMS:
+            self.send_error(400, "op should be one of: %s" % ", ".join(STREAMS))
+            return
+        try:
+            length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            self.send_error(411)
+            return
+
+        stream_fn, content_type = STREAMS[op]
+        stream = stream_fn(function_runtime.read_body(self.rfile, length, bytearray(CHUNK_SIZE)))
+        try:
+            # produce the first chunk before committing to a 200
+            first = next(stream, b"")
+        except (binascii.Error, ConnectionError) as e:
+            self.send_error(400, "Invalid input: %s" % e)
+            return
 
         self.send_response(200)
-        self.send_header("Content-type", "text/html")
+        self.send_header("Content-type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
         self.end_headers()
-        self.wfile.write(bytes("<html>\n<head><title>Function Execution Results</title></head>\n", "utf-8"))
-        self.wfile.write(bytes("<body>\n", "utf-8"))
-        self.wfile.write(bytes("<p>Encoded: %s</p>\n" % result['s_encode'], "utf-8"))
-        self.wfile.write(bytes("<p>Decoded: %s</p>\n" % result['s_decode'], "utf-8"))
-        self.wfile.write(bytes("</body>\n</html>", "utf-8"))
 
-def run(server_class=HTTPServer, handler_class=FunctionServer):
-    server_address = ("0.0.0.0", 8000)
-    httpd = server_class(server_address, handler_class)
-    print("Launching server...")
-
-    try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        pass
+        out = function_runtime.ChunkedWriter(self.wfile)
+        try:
+            out.write(first)
+            for data in stream:
+                out.write(data)
+        except (binascii.Error, ConnectionError) as e:
+            # headers are already out: end without the last chunk so the
+            # client sees a truncated body instead of a short success
+            self.log_error("base64 %s stream aborted: %s", op, e)
+            self.close_connection = True
+            return
+        out.close()
 
-    httpd.server_close()
-    print("\nServer stopped.")
+def run(server_class=function_aio.AsyncHTTPServer, handler_class=FunctionServer):
+    server_address = ("0.0.0.0", 8000)
+    function_runtime.serve(handler_class, server_class=server_class, address=server_address)
 
 if __name__ == "__main__":
     run()
@@ -0,0 +1,305 @@
+"""Microbenchmarks of the function kernels, without HTTP in the way.
+
+Each case calls a kernel directly on one input size. Its setup (building
+inputs, emptying the caches a request would otherwise hit) is not timed.
+A case runs a few untimed warm-up calls, then ``--repeat`` timed calls
+(median, mean, p90, min, max and standard deviation), then one more call
+under tracemalloc for the peak Python memory.
+
+Results can be saved as the baseline of this machine, and later runs are
+compared with it. A case whose median time or peak memory grew by more than
+``--threshold`` is a regression, and the exit status is 1.
+
+    python bench_kernels.py --save                     # record baselines/<machine>.json
+    python bench_kernels.py primes json --compare      # after a change
+    python bench_kernels.py --quick --output bench.json
+
+A function whose dependencies or corpora are missing is skipped. Any other
+error in a kernel is a failure: the exit status is 1, and with --compare its
+baseline cases count as regressions.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import sys
+import time
+import tracemalloc
+
+import function_registry
+
+try:
+    # what TextBlob raises instead of NLTK's LookupError
+    from textblob.exceptions import MissingCorpusError
+except ImportError:
+    MissingCorpusError = LookupError
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE_DIR = os.path.join(HERE, "baselines")
+
+# name -> (directory, server script); the kernels are looked up in CASES
+SERVERS = {
+    'base64': ("base64", "web-server-base64.py"),
+    'json': ("json", "web-server-json.py"),
+    'primes': ("primes", "web-server-primes.py"),
+    'sentiment': ("sentiment-analysis", "web-server-senti.py"),
+    'compress': ("compress", "web-server-compress.py"),
+}
+
+SEED = 1234
+# extra peak memory below this is noise, not a regression
+MEMORY_SLACK = 64 * 1024
+# what a function without its optional dependencies or data fails with
+MISSING_DATA = (ImportError, LookupError, MissingCorpusError)
+
+
+def load(name):
+    directory, script = SERVERS[name]
+    return function_registry.load_server(os.path.join(HERE, directory, script))
+
+
+# Each case builder gets the server module and yields (case, size, setup, call):
+# setup() returns the argument of call(), so only call() is timed.
+
+def base64_cases(module, quick):
+    yield "base64py", "1MB x 100", lambda: None, lambda _: module.base64py()
+    for size in (1024, 1024 * 1024) if quick else (1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024):
+        data = random.Random(SEED).randbytes(size) if hasattr(random.Random, "randbytes") else os.urandom(size)
+
+        def round_trip(data):
+            chunks = [data[i:i + module.CHUNK_SIZE] for i in range(0, len(data), module.CHUNK_SIZE)]
+            encoded = list(module.base64_encode_stream(chunks))
+            return sum(len(part) for part in module.base64_decode_stream(encoded))
+        yield "stream_round_trip", size, (lambda data=data: data), round_trip
+
+
+def json_cases(module, quick):
+    for count in (10, 1000) if quick else (10, 1000, 100000):
+        rng = random.Random(SEED)
+        params = {'coordinates': [{'x': rng.random(), 'y': rng.random(), 'z': rng.random(),
+                                   'name': "point %d" % i, 'opts': {'1': [1, True]}} for i in range(count)]}
+        document = json.dumps(params)
+        yield "jsonpy", count, (lambda document=document: document), lambda document: module.jsonpy(json.loads(document))
+        documents = [document.encode("utf-8")] * 16
+        yield "jsonpy_batch x16", count, (lambda documents=documents: documents), module.jsonpy_batch
+
+
+def primes_cases(module, quick):
+    for n in (10 ** 4, 10 ** 6) if quick else (10 ** 4, 10 ** 6, 10 ** 7, 10 ** 8):
+        def fresh_table():
+            # a new table, so the sieve runs instead of a lookup
+            module.TABLE = module.prime_table.PrimeTable()
+        yield "primespy", n, fresh_table, lambda _, n=n: module.primespy(n)
+
+
+def sentiment_cases(module, quick):
+    with open(os.path.join(HERE, "sentiment-analysis", "senti-data.json")) as f:
+        text = json.load(f)['analyse']
+    for copies in (1, 4) if quick else (1, 4, 16):
+        def cold_cache(params={'analyse': " ".join([text] * copies)}):
+            module.SENTENCE_CACHE.clear()
+            return params
+        yield "sentimentpy", "%d x senti-data" % copies, cold_cache, lambda params: module.sentimentpy(params, parallel=False)
+
+
+def compress_cases(module, quick):
+    def seeded():
+        random.seed(SEED)
+    yield "generate_lorem_deflate", "1-9 paragraphs", seeded, lambda _: module.generate_lorem_deflate()
+    for paragraphs in (10, 1000) if quick else (10, 1000, 10000):
+        options = module.stream_options({'paragraphs': [str(paragraphs)]})
+
+        def stream(_, options=options):
+            return sum(len(chunk) for chunk in module.lorem_deflate_stream(options, {}))
+        yield "lorem_deflate_stream", paragraphs, seeded, stream
+
+
+CASES = {
+    'base64': base64_cases,
+    'json': json_cases,
+    'primes': primes_cases,
+    'sentiment': sentiment_cases,
+    'compress': compress_cases,
+}
+
+
+def percentile(sorted_values, p):
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def measure(setup, call, repeat, warmup):
+    for _ in range(warmup):
+        call(setup())
+
+    times = []
+    gc_was_enabled = gc.isenabled()
+    for _ in range(repeat):
+        argument = setup()
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            call(argument)
+            times.append(time.perf_counter() - start)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    argument = setup()
+    tracemalloc.start()
+    try:
+        call(argument)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    times.sort()
+    return {
+        'repeat': repeat,
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'p90': percentile(times, 90),
+        'min': times[0],
+        'max': times[-1],
+        'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+        'peak_memory': peak,
+    }
+
+
+def case_id(function, case, size):
+    return "%s/%s/%s" % (function, case, size)
+
+
+def run(functions, args):
+    """Benchmark ``functions``; (results, {function: error} of the kernels that failed)."""
+    results = {}
+    failures = {}
+    for name in functions:
+        try:
+            module = load(name)
+        except ImportError as e:
+            print("skipping %s: %s" % (name, e), file=sys.stderr)
+            continue
+        try:
+            for case, size, setup, call in CASES[name](module, args.quick):
+                result = measure(setup, call, args.repeat, args.warmup)
+                result.update({'function': name, 'case': case, 'size': size})
+                results[case_id(name, case, size)] = result
+                print("%-48s median %10.3f ms  p90 %10.3f ms  peak %10.1f KiB" % (
+                    case_id(name, case, size), result['median'] * 1000, result['p90'] * 1000,
+                    result['peak_memory'] / 1024), file=sys.stderr)
+        except MISSING_DATA as e:
+            # a missing corpus or model fails on the first call, not on import
+            print("skipping %s: %s: %s" % (name, type(e).__name__, e), file=sys.stderr)
+        except Exception as e:
+            failures[name] = "%s: %s" % (type(e).__name__, e)
+            print("FAILED %s: %s" % (name, failures[name]), file=sys.stderr)
+    return results, failures
+
+
+def machine_info():
+    return {
+        'hostname': socket.gethostname(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+    }
+
+
+def baseline_path(args):
+    return os.path.join(args.baseline_dir, "%s.json" % args.machine)
+
+
+def compare(results, baseline, threshold, failures=None):
+    """Compare with a baseline's results; a list of regressions.
+
+    A baseline case of a function in ``failures`` without a result is one too.
+    """
+    regressions = []
+    for key, before in sorted(baseline.items()):
+        if key not in results and before.get('function') in (failures or {}):
+            regressions.append("%s: no result, %s" % (key, failures[before['function']]))
+    for key, result in results.items():
+        before = baseline.get(key)
+        if before is None:
+            continue
+        time_ratio = result['median'] / before['median'] if before['median'] else 1.0
+        result['baseline_median'] = before['median']
+        result['time_ratio'] = time_ratio
+        if time_ratio > 1 + threshold:
+            regressions.append("%s: median %.3f ms -> %.3f ms (%+.0f%%)" % (
+                key, before['median'] * 1000, result['median'] * 1000, (time_ratio - 1) * 100))
+        grown = result['peak_memory'] - before['peak_memory']
+        if grown > MEMORY_SLACK and result['peak_memory'] > before['peak_memory'] * (1 + threshold):
+            regressions.append("%s: peak memory %d -> %d bytes" % (key, before['peak_memory'], result['peak_memory']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark the function kernels.")
+    parser.add_argument("functions", nargs="*", help="functions to benchmark: %s (default: all)" % ", ".join(CASES))
+    parser.add_argument("--repeat", type=int, default=10, help="timed calls per case")
+    parser.add_argument("--warmup", type=int, default=2, help="untimed calls before timing")
+    parser.add_argument("--quick", action="store_true", help="only the small input sizes")
+    parser.add_argument("--machine", default=socket.gethostname(), help="baseline name (default: the hostname)")
+    parser.add_argument("--baseline-dir", default=BASELINE_DIR)
+    parser.add_argument("--save", action="store_true", help="store the results as this machine's baseline")
+    parser.add_argument("--compare", action="store_true", help="fail on regressions against this machine's baseline")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown, as a fraction (default 0.10)")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+    unknown = set(args.functions) - set(CASES)
+    if unknown:
+        parser.error("unknown functions: %s" % ", ".join(sorted(unknown)))
+    if args.repeat < 1:
+        parser.error("--repeat should be at least 1")
+
+    results, failures = run(args.functions or list(CASES), args)
+    report = {'machine': machine_info(), 'quick': args.quick, 'timestamp': time.time(), 'results': results}
+    if failures:
+        report['failures'] = failures
+
+    status = 1 if failures else 0
+    if args.compare:
+        try:
+            with open(baseline_path(args)) as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            print("no baseline at %s, run with --save first" % baseline_path(args), file=sys.stderr)
+            sys.exit(2)
+        regressions = compare(results, baseline['results'], args.threshold, failures)
+        report['regressions'] = regressions
+        for line in regressions:
+            print("REGRESSION %s" % line, file=sys.stderr)
+        if regressions:
+            status = 1
+
+    if args.save:
+        os.makedirs(args.baseline_dir, exist_ok=True)
+        path = baseline_path(args)
+        if os.path.exists(path):
+            # keep the cases this run did not cover
+            with open(path) as f:
+                previous = json.load(f)['results']
+            results = dict(previous, **results)
+        with open(path, "w") as f:
+            json.dump(dict(report, results=results), f, indent=2, sort_keys=True)
+        print("saved baseline %s" % path, file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    sys.exit(status)
+
+
+if __name__ == "__main__":
+    main()
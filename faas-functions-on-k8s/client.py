@@ -1,29 +1,388 @@
-import requests as req
+"""Open-loop load generator for the function servers.
+
+Requests are scheduled at a constant arrival rate, independent of how fast
+the server answers, and sent over a pool of persistent HTTP/1.1
+connections. Each latency is measured from the time the request was
+*scheduled*, not from when a free connection let it go out. A stalled
+server therefore shows up in the percentiles instead of silently lowering
+the request rate (coordinated omission, corrected the same way wrk2 does).
+The uncorrected service time is reported next to it.
+
+Latencies go into HDR-style log-linear histograms (about 1.5% relative
+precision from 1 microsecond to an hour). The result is printed as JSON.
+
+    python client.py primes --rate 200 --duration 30 --connections 8
+    python client.py sentiment --rate 20 --duration 60 --warmup 10 --output senti.json
+    python client.py json --path /json/ --port 8000     # through the multi-function host
+    python client.py json --payload-size 4MB --rate 5    # synthetic body, see payloads.py
+    python client.py base64 --once                      # one request, print the response
+
+No third-party packages are needed.
+"""
+import argparse
+import asyncio
 import json
+import math
+import os
 import sys
+import time
+
+import payloads
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# name -> (method, path, request body file)
+FUNCTIONS = {
+    'base64': ("GET", "/", None),
+    'json': ("POST", "/", "json/json-data.json"),
+    'primes': ("GET", "/", None),
+    'sentiment': ("POST", "/", "sentiment-analysis/senti-data.json"),
+    'compress': ("GET", "/", None),
+}
+
+PERCENTILES = (50, 75, 90, 99, 99.9, 99.99, 100)
+
+
+class LatencyHistogram:
+    """Log-linear histogram of latencies in microseconds, like HdrHistogram.
+
+    Values below SUB_BUCKETS are exact; above, every power of two is split
+    into SUB_BUCKETS / 2 buckets.
+    """
+    SUB_BITS = 7
+    SUB_BUCKETS = 1 << SUB_BITS
+    HALF = SUB_BUCKETS // 2
+    MAX_VALUE = 3600 * 1000 * 1000
+
+    def __init__(self):
+        self.counts = [0] * (self.index(self.MAX_VALUE) + 1)
+        self.total = 0
+        self.sum = 0
+        self.max = 0
+
+    @classmethod
+    def index(cls, value):
+        if value < cls.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - cls.SUB_BITS
+        return cls.SUB_BUCKETS + (shift - 1) * cls.HALF + (value >> shift) - cls.HALF
+
+    @classmethod
+    def highest_equivalent(cls, index):
+        """Largest value counted in bucket ``index``."""
+        if index < cls.SUB_BUCKETS:
+            return index
+        shift = (index - cls.SUB_BUCKETS) // cls.HALF + 1
+        mantissa = (index - cls.SUB_BUCKETS) % cls.HALF + cls.HALF
+        return ((mantissa + 1) << shift) - 1
+
+    def record(self, seconds):
+        value = min(max(int(seconds * 1e6), 0), self.MAX_VALUE)
+        self.counts[self.index(value)] += 1
+        self.total += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p):
+        """Latency in ms at or below which ``p`` percent of the requests finished."""
+        if not self.total:
+            return None
+        target = max(1, math.ceil(self.total * p / 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(self.highest_equivalent(index), self.max) / 1000
+        return self.max / 1000
+
+    def summary(self):
+        return {
+            'count': self.total,
+            'mean_ms': self.sum / self.total / 1000 if self.total else None,
+            'max_ms': self.max / 1000 if self.total else None,
+            'percentiles_ms': {str(p): self.percentile(p) for p in PERCENTILES},
+        }
+
+    def buckets(self):
+        """Non-empty buckets as [highest equivalent value in ms, count]."""
+        return [[self.highest_equivalent(i) / 1000, count] for i, count in enumerate(self.counts) if count]
+
+
+class Connection:
+    """One persistent HTTP/1.1 connection of the pool."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, head, body=b""):
+        """Send a prebuilt request; (status, response bytes)."""
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(head)
+        if body:
+            # a view, so a memory-mapped payload is not copied first
+            self.writer.write(memoryview(body))
+            await self.writer.drain()
+        head = await self.reader.readuntil(b"\r\n\r\n")
+        lines = head.decode("latin-1").split("\r\n")
+        status = int(lines[0].split(" ", 2)[1])
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            if name:
+                headers[name.strip().lower()] = value.strip()
+
+        size = len(head)
+        if status in (204, 304) or 100 <= status < 200:
+            pass
+        elif "content-length" in headers:
+            size += len(await self.reader.readexactly(int(headers["content-length"])))
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            size += await self.read_chunked()
+        else:
+            # the body runs until the server closes the connection
+            size += len(await self.reader.read())
+            headers["connection"] = "close"
+
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, size
+
+    async def read_chunked(self):
+        size = 0
+        while True:
+            line = await self.reader.readline()
+            chunk = int(line.split(b";")[0], 16)
+            if chunk == 0:
+                # trailer fields, then the empty line
+                while (await self.reader.readline()) not in (b"\r\n", b""):
+                    pass
+                return size
+            size += len(await self.reader.readexactly(chunk + 2)) - 2
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def build_request(args):
+    method, path, body_file = FUNCTIONS[args.function]
+    if args.path:
+        path = args.path
+    if args.payload_size is not None:
+        # serialized once, then sent as is by every request
+        body = payloads.payload(args.function, args.payload_size, args.seed)
+    elif args.body or body_file:
+        with open(args.body or os.path.join(HERE, body_file), "rb") as f:
+            body = f.read()
+    else:
+        body = b""
+    if args.method:
+        method = args.method
+    headers = ["%s %s HTTP/1.1" % (method, path), "Host: %s:%d" % (args.host, args.port)]
+    if args.accept:
+        headers.append("Accept: %s" % args.accept)
+    if body or method == "POST":
+        headers.append("Content-Type: application/json")
+        headers.append("Content-Length: %d" % len(body))
+    return ("\r\n".join(headers) + "\r\n\r\n").encode("latin-1"), body
+
+
+class LoadRun:
+    def __init__(self, args, head, body):
+        self.args = args
+        self.head = head
+        self.body = body
+        self.corrected = LatencyHistogram()
+        self.uncorrected = LatencyHistogram()
+        self.statuses = {}
+        self.errors = {}
+        self.bytes_read = 0
+        self.scheduled = 0
+        self.dropped = 0
+
+    def error(self, kind):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def timed_out(self, intended, measured):
+        # the slowest requests of all: left out, they would hide the tail
+        if measured:
+            self.error("timeout")
+            self.corrected.record(asyncio.get_running_loop().time() - intended)
+
+    async def send(self, pool, intended, measured):
+        try:
+            await self.send_request(pool, intended, measured)
+        except asyncio.CancelledError:
+            # still queued for a connection, or in flight, when the run ended
+            self.timed_out(intended, measured)
+            raise
+
+    async def send_request(self, pool, intended, measured):
+        loop = asyncio.get_running_loop()
+        connection = await pool.get()
+        connected = connection.writer is not None
+        sent = loop.time()
+        try:
+            status, size = await asyncio.wait_for(connection.request(self.head, self.body), self.args.timeout)
+        except asyncio.TimeoutError:
+            connection.close()
+            self.timed_out(intended, measured)
+            return
+        except OSError:
+            connection.close()
+            if measured:
+                self.error("read" if connected else "connect")
+            return
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, IndexError):
+            connection.close()
+            if measured:
+                self.error("read")
+            return
+        finally:
+            pool.put_nowait(connection)
+        done = loop.time()
+        if measured:
+            self.corrected.record(done - intended)
+            self.uncorrected.record(done - sent)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.bytes_read += size
+
+    async def run(self):
+        args = self.args
+        loop = asyncio.get_running_loop()
+        pool = asyncio.LifoQueue()
+        connections = [Connection(args.host, args.port) for _ in range(args.connections)]
+        for connection in connections:
+            pool.put_nowait(connection)
+
+        interval = 1.0 / args.rate
+        start = loop.time() + 0.01
+        measure_from = start + args.warmup
+        end = measure_from + args.duration
+        tasks = set()
+        i = 0
+        while True:
+            intended = start + i * interval
+            if intended >= end:
+                break
+            delay = intended - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            i += 1
+            measured = intended >= measure_from
+            if measured:
+                self.scheduled += 1
+            if len(tasks) >= args.max_outstanding:
+                # the server is so far behind that even queueing is pointless
+                if measured:
+                    self.dropped += 1
+                continue
+            task = loop.create_task(self.send(pool, intended, measured))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.wait(tasks, timeout=args.timeout + 1)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            # let the cancelled requests count themselves
+            await asyncio.wait(tasks)
+        for connection in connections:
+            connection.close()
+        self.elapsed = loop.time() - measure_from
+
+    def report(self):
+        args = self.args
+        completed = sum(self.statuses.values())
+        result = {
+            'function': args.function,
+            'target': "http://%s:%d%s" % (args.host, args.port, args.path or FUNCTIONS[args.function][1]),
+            'rate': args.rate,
+            'duration': args.duration,
+            'warmup': args.warmup,
+            'connections': args.connections,
+            'request_bytes': len(self.body),
+            'scheduled': self.scheduled,
+            'completed': completed,
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'status': {str(status): count for status, count in sorted(self.statuses.items())},
+            'throughput': completed / self.elapsed if self.elapsed > 0 else 0.0,
+            'bytes_read': self.bytes_read,
+            'latency': self.corrected.summary(),
+            'service_time': self.uncorrected.summary(),
+            'timestamp': time.time(),
+        }
+        if args.histogram:
+            result['latency']['buckets'] = self.corrected.buckets()
+            result['service_time']['buckets'] = self.uncorrected.buckets()
+        return result
+
+
+async def once(args, head, body):
+    """The old client.py behaviour: one request, print the response."""
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+    writer.write(head.replace(b"HTTP/1.1\r\n", b"HTTP/1.1\r\nConnection: close\r\n", 1))
+    writer.write(memoryview(body))
+    response = await reader.read()
+    writer.close()
+    print(response.partition(b"\r\n\r\n")[2].decode("utf-8", "replace"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load generator for the function servers.")
+    parser.add_argument("function", nargs="?", default="base64", choices=list(FUNCTIONS))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--path", help="request path, e.g. /primes/?n=1000 or a host route")
+    parser.add_argument("--method", help="override the function's HTTP method")
+    parser.add_argument("--body", help="request body file instead of the function's sample payload")
+    parser.add_argument("--payload-size", type=payloads.parse_size,
+                        help="synthetic body of this size (json, sentiment), e.g. 1KB or 64MB")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic body")
+    parser.add_argument("--accept", help="Accept header, e.g. application/json")
+    parser.add_argument("--rate", type=float, default=10, help="requests per second (constant arrival rate)")
+    parser.add_argument("--duration", type=float, default=10, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=0, help="seconds of load before measuring")
+    parser.add_argument("--connections", type=int, default=4, help="persistent connections in the pool")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds before a request counts as timed out")
+    parser.add_argument("--max-outstanding", type=int, default=10000, help="scheduled requests that may wait for a connection")
+    parser.add_argument("--histogram", action="store_true", help="include the histogram buckets in the output")
+    parser.add_argument("--output", help="also write the JSON result to this file")
+    parser.add_argument("--once", action="store_true", help="send one request and print the response body")
+    args = parser.parse_args()
+    if args.rate <= 0 or args.connections < 1:
+        parser.error("--rate must be > 0 and --connections >= 1")
+    if args.payload_size is not None:
+        if args.function not in payloads.GENERATORS:
+            parser.error("--payload-size works for %s only" % ", ".join(payloads.GENERATORS))
+        try:
+            payloads.check_size(args.function, args.payload_size)
+        except ValueError as e:
+            parser.error(str(e))
+
+    head, body = build_request(args)
+    if args.once:
+        asyncio.run(once(args, head, body))
+        return
+
+    run = LoadRun(args, head, body)
+    asyncio.run(run.run())
+    result = run.report()
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    if not result['completed']:
+        sys.exit(1)
+
 
-host = 'localhost'
-port = '8000'
-function = 'base64'
-
-if function == 'base64':
-    # GET - base64
-    resp = req.request(method='GET', url='http://'+host+':'+port)
-    print(resp.text)
-elif function == 'json':
-    # POST - json
-    # data = {'name': 'value'}
-    with open('json-data.json') as f:
-        data = json.load(f)
-    resp = req.post('http://'+host+':'+port, json=data)
-    print(resp.text)
-elif function == 'primes':
-    # GET - primes
-    resp = req.request(method='GET', url='http://'+host+':'+port)
-    print(resp.text)
-elif function == 'sentiment':
-    # POST - sentiment
-    with open('senti-data.json') as f:
-        data = json.load(f)
-    resp = req.post('http://'+host+':'+port, json=data)
-    print(resp.text)
+if __name__ == "__main__":
+    main()
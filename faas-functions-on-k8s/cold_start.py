@@ -0,0 +1,185 @@
+"""Time-to-first-response benchmark for the function servers.
+
+Starts each function server from scratch (a local process, or its Docker
+image with --docker), sends the function's usual request as soon as the
+port accepts connections and records, relative to the moment the process
+was started:
+
+    listen          first accepted connection
+    first_response  first function response fully received
+    ready           first 200 from GET /ready
+
+It also records the latency of that first request, the median latency of a
+few warm requests after it, and the startup phases the server reports on
+/ready. One JSON object per run is printed, and written to --output.
+
+    python cold_start.py                      # all five functions, 3 runs each
+    python cold_start.py primes sentiment --runs 10 --output cold.json
+    python cold_start.py --docker compress
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# name -> (server script, Docker image, method, path, request body file)
+FUNCTIONS = {
+    'base64': ("base64/web-server-base64.py", "haoranq4/base64", "GET", "/", None),
+    'json': ("json/web-server-json.py", "haoranq4/json", "POST", "/", "json/json-data.json"),
+    'primes': ("primes/web-server-primes.py", "haoranq4/primes", "GET", "/", None),
+    'sentiment': ("sentiment-analysis/web-server-senti.py", "haoranq4/sentiment", "POST", "/", "sentiment-analysis/senti-data.json"),
+    'compress': ("compress/web-server-compress.py", "haoranq4/compress", "GET", "/", None),
+}
+
+POLL_INTERVAL = 0.005
+
+
+def request(host, port, method, path, body=None, timeout=60):
+    """Send one request on a new connection; (status, body)."""
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        return response.status, response.read()
+    finally:
+        conn.close()
+
+
+def wait_for_port(host, port, deadline):
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(POLL_INTERVAL)
+    return False
+
+
+def start(name, args):
+    script, image, _, _, _ = FUNCTIONS[name]
+    if args.docker:
+        command = ["docker", "run", "--rm", "--name", "cold-start-%s" % name, "-p", "%d:8000" % args.port, image]
+        return subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+    path = os.path.join(HERE, script)
+    # through function_registry, which puts the shared modules on the path
+    return subprocess.Popen([sys.executable, os.path.join(HERE, "function_registry.py"), path],
+                            cwd=os.path.dirname(path), env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def stop(name, process, args):
+    if args.docker:
+        subprocess.run(["docker", "stop", "-t", "5", "cold-start-%s" % name],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def measure(name, args):
+    """One cold start of ``name``; a dict of timings in seconds."""
+    _, _, method, path, body_file = FUNCTIONS[name]
+    body = None
+    if body_file:
+        with open(os.path.join(HERE, body_file), "rb") as f:
+            body = f.read()
+    host, port = args.host, args.port
+
+    result = {'function': name, 'docker': args.docker}
+    started = time.monotonic()
+    process = start(name, args)
+    deadline = started + args.timeout
+    try:
+        if not wait_for_port(host, port, deadline):
+            result['error'] = "server did not listen within %ss" % args.timeout
+            return result
+        result['listen'] = time.monotonic() - started
+
+        try:
+            # the first request goes out as soon as the port accepts it, like
+            # traffic reaching a new pod without a readiness gate
+            while True:
+                sent = time.monotonic()
+                try:
+                    status, _ = request(host, port, method, path, body)
+                    break
+                except (ConnectionError, http.client.RemoteDisconnected):
+                    if sent > deadline:
+                        raise
+                    time.sleep(POLL_INTERVAL)
+            done = time.monotonic()
+            result['first_status'] = status
+            result['first_response'] = done - started
+            result['first_latency'] = done - sent
+
+            report = None
+            while time.monotonic() < deadline:
+                status, data = request(host, port, "GET", "/ready")
+                if status == 200:
+                    result['ready'] = time.monotonic() - started
+                    report = json.loads(data)
+                    break
+                time.sleep(POLL_INTERVAL)
+            if report is not None:
+                result['phases'] = report.get('phases')
+                result['server_time_to_ready'] = report.get('time_to_ready')
+
+            latencies = []
+            for _ in range(args.warm_requests):
+                sent = time.monotonic()
+                request(host, port, method, path, body)
+                latencies.append(time.monotonic() - sent)
+            if latencies:
+                result['warm_latency'] = statistics.median(latencies)
+        except (OSError, http.client.HTTPException) as e:
+            # a server that crashes or hangs is a failed start, not a failed run
+            result['error'] = "%s: %s" % (type(e).__name__, e)
+        return result
+    finally:
+        stop(name, process, args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start time to first response of the function servers.")
+    parser.add_argument("functions", nargs="*", help="functions to measure: %s (default: all)" % ", ".join(FUNCTIONS))
+    parser.add_argument("--runs", type=int, default=3, help="cold starts per function")
+    parser.add_argument("--warm-requests", type=int, default=5, help="requests timed after the first one")
+    parser.add_argument("--docker", action="store_true", help="start the Docker images instead of local processes")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--timeout", type=float, default=120, help="seconds a start may take")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+    unknown = set(args.functions) - set(FUNCTIONS)
+    if unknown:
+        parser.error("unknown functions: %s" % ", ".join(sorted(unknown)))
+
+    results = []
+    for name in args.functions or list(FUNCTIONS):
+        for run in range(args.runs):
+            result = measure(name, args)
+            result['run'] = run
+            print(json.dumps(result))
+            results.append(result)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
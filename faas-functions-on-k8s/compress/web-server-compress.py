@@ -1,50 +1,166 @@
-from http.server import HTTPServer, BaseHTTPRequestHandler
-import asyncio
+from urllib.parse import urlparse, parse_qs
 import zlib
 import lorem
 from random import randint
 import base64
+import json
+import threading
+import time
 
-class AsyncHTTPRequestHandler(BaseHTTPRequestHandler):
-    async def generate_lorem_deflate(self):
-        # Generate lorem ipsum paragraphs
-        text = lorem.paragraphs(randint(1, 9))
+import function_aio
+import function_runtime
 
-        # Convert the text to bytes
-        read_stream = text.encode('utf-8')
+def generate_lorem_deflate():
+    # Generate lorem ipsum paragraphs (the lorem package only makes one at a time)
+    text = "\n\n".join(lorem.paragraph() for _ in range(randint(1, 9)))
 
-        # Compress the data using zlib (deflate)
-        compressed_data = zlib.compress(read_stream)
+    # Convert the text to bytes
+    read_stream = text.encode('utf-8')
 
-        # Encode compressed data in base64 to ensure it's text-based for HTTP transmission
-        encoded_data = base64.b64encode(compressed_data)
+    # Compress the data using zlib (deflate)
+    compressed_data = zlib.compress(read_stream)
 
-        return encoded_data.decode('utf-8')
+    # Encode compressed data in base64 to ensure it's text-based for HTTP transmission
+    encoded_data = base64.b64encode(compressed_data)
+
+    return encoded_data.decode('utf-8')
+
+# stream mode parameters
+ENCODINGS = {
+    # Content-Encoding -> wbits offset ("deflate" is the zlib format, RFC 9110)
+    'deflate': 0,
+    'gzip': 16,
+}
+STRATEGIES = {
+    'default': zlib.Z_DEFAULT_STRATEGY,
+    'filtered': zlib.Z_FILTERED,
+    'huffman': zlib.Z_HUFFMAN_ONLY,
+    'rle': zlib.Z_RLE,
+    'fixed': zlib.Z_FIXED,
+}
+MAX_PARAGRAPHS = 100000
+
+# totals over every stream-mode response of this worker, see GET /stats
+STREAM_STATS = {'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'compress_seconds': 0.0}
+STREAM_STATS_LOCK = threading.Lock()
+
+def stream_options(query):
+    # parse and check the stream mode query parameters, raises ValueError
+    def get(name, default):
+        return query.get(name, [default])[0]
+
+    encoding = get('encoding', 'deflate')
+    if encoding not in ENCODINGS:
+        raise ValueError("encoding should be one of: %s" % ", ".join(ENCODINGS))
+    strategy = get('strategy', 'default')
+    if strategy not in STRATEGIES:
+        raise ValueError("strategy should be one of: %s" % ", ".join(STRATEGIES))
+    level = int(get('level', zlib.Z_DEFAULT_COMPRESSION))
+    if not -1 <= level <= 9:
+        raise ValueError("level should be between -1 and 9")
+    wbits = int(get('wbits', zlib.MAX_WBITS))
+    if not 9 <= wbits <= 15:
+        raise ValueError("wbits should be between 9 and 15")
+    memlevel = int(get('memlevel', zlib.DEF_MEM_LEVEL))
+    if not 1 <= memlevel <= 9:
+        raise ValueError("memlevel should be between 1 and 9")
+    paragraphs = int(get('paragraphs', randint(1, 9)))
+    if not 1 <= paragraphs <= MAX_PARAGRAPHS:
+        raise ValueError("paragraphs should be between 1 and %d" % MAX_PARAGRAPHS)
+    return {'encoding': encoding, 'level': level, 'wbits': wbits, 'memlevel': memlevel,
+            'strategy': strategy, 'paragraphs': paragraphs}
+
+def lorem_deflate_stream(options, report):
+    # compress generated paragraphs one by one; fills report with bytes in/out and time
+    compressor = zlib.compressobj(options['level'], zlib.DEFLATED,
+                                  options['wbits'] + ENCODINGS[options['encoding']],
+                                  options['memlevel'], STRATEGIES[options['strategy']])
+    bytes_in = 0
+    bytes_out = 0
+    elapsed = 0.0
+    for i in range(options['paragraphs']):
+        data = (lorem.paragraph() + ("\n\n" if i + 1 < options['paragraphs'] else "")).encode('utf-8')
+        start = time.perf_counter()
+        out = compressor.compress(data)
+        elapsed += time.perf_counter() - start
+        bytes_in += len(data)
+        if out:
+            bytes_out += len(out)
+            yield out
+    start = time.perf_counter()
+    out = compressor.flush()
+    elapsed += time.perf_counter() - start
+    bytes_out += len(out)
+    report.update({'bytes_in': bytes_in, 'bytes_out': bytes_out, 'compress_seconds': elapsed})
+    yield out
+
+class AsyncHTTPRequestHandler(function_runtime.FunctionHandler):
+    function_name = "compress"
+    html_title = "Async Function Execution Results"
+
+    @classmethod
+    def warm_up(cls):
+        generate_lorem_deflate()
+        list(lorem_deflate_stream(stream_options({'paragraphs': ['1']}), {}))
 
     def do_GET(self):
-        # Execute the async function and wait for result
-        result = asyncio.run(self.generate_lorem_deflate())
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            self.send_stats()
+            return
+        query = parse_qs(url.query)
+        if query.get('mode', [None])[0] == 'stream':
+            self.send_stream(query)
+            return
+
+        # CPU-bound: the asyncio front end runs this handler on its executor
+        result = generate_lorem_deflate()
+
+        self.send_result({'Result': result}, ["Result: %s" % result])
+
+    def send_stream(self, query):
+        # ?mode=stream: the compressed text itself, chunked, with a Content-Encoding
+        try:
+            options = stream_options(query)
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
 
         self.send_response(200)
-        self.send_header("Content-type", "text/html")
+        self.send_header("Content-type", "text/plain; charset=utf-8")
+        self.send_header("Content-Encoding", options['encoding'])
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Trailer", "X-Bytes-In, X-Bytes-Out, X-Compress-Time")
         self.end_headers()
-        self.wfile.write(bytes("<html>\n<head><title>Async Function Execution Results</title></head>\n", "utf-8"))
-        self.wfile.write(bytes("<body>\n", "utf-8"))
-        self.wfile.write(bytes(f"<p>Result: {result}</p>\n", "utf-8"))
-        self.wfile.write(bytes("</body>\n</html>", "utf-8"))
 
-def run(server_class=HTTPServer, handler_class=AsyncHTTPRequestHandler, port=8000):
-    server_address = ("", port)
-    httpd = server_class(server_address, handler_class)
-    print(f"Launching server on port {port}...")
+        report = {}
+        out = function_runtime.ChunkedWriter(self.wfile)
+        for data in lorem_deflate_stream(options, report):
+            out.write(data)
+        out.close({
+            'X-Bytes-In': report['bytes_in'],
+            'X-Bytes-Out': report['bytes_out'],
+            'X-Compress-Time': "%.6f" % report['compress_seconds'],
+        })
+
+        with STREAM_STATS_LOCK:
+            STREAM_STATS['responses'] += 1
+            for key in ('bytes_in', 'bytes_out', 'compress_seconds'):
+                STREAM_STATS[key] += report[key]
+        self.log_message("stream %s level=%d wbits=%d memlevel=%d strategy=%s: %d -> %d bytes in %.6fs",
+                         options['encoding'], options['level'], options['wbits'], options['memlevel'],
+                         options['strategy'], report['bytes_in'], report['bytes_out'], report['compress_seconds'])
 
-    try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        pass
+    def send_stats(self):
+        with STREAM_STATS_LOCK:
+            stats = dict(STREAM_STATS)
+        stats['ratio'] = stats['bytes_out'] / stats['bytes_in'] if stats['bytes_in'] else 0.0
+        stats['throughput_bytes_per_second'] = stats['bytes_in'] / stats['compress_seconds'] if stats['compress_seconds'] else 0.0
+        self.send_body(json.dumps(stats).encode("utf-8"), "application/json")
 
-    httpd.server_close()
-    print("\nServer stopped.")
+def run(server_class=function_aio.AsyncHTTPServer, handler_class=AsyncHTTPRequestHandler, port=8000):
+    server_address = ("", port)
+    function_runtime.serve(handler_class, server_class=server_class, address=server_address)
 
 if __name__ == "__main__":
     run()
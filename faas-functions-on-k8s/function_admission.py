@@ -0,0 +1,174 @@
+"""Admission control: a concurrency limit per function with a bounded wait queue.
+
+A request over its function's concurrency limit waits for a slot, but only
+while fewer than FUNCTION_QUEUE requests are already waiting and for at most
+FUNCTION_QUEUE_TIMEOUT seconds. Otherwise it is shed right away with a 503
+and a Retry-After, so an overloaded server answers quickly instead of letting
+requests pile up behind the ones it can serve.
+
+``AsyncAdmission`` runs on the asyncio front end's loop, where a waiting or
+shed request holds no thread. ``ThreadAdmission`` serves the thread-per-
+connection front end. Both count admitted and shed requests and the queue
+length in ``function_metrics``.
+
+Configuration (environment variables):
+    FUNCTION_CONCURRENCY    requests a function runs at once per worker
+                            (default 0: no limit; the host uses HOST_CONCURRENCY)
+    FUNCTION_QUEUE          requests that may wait for a slot (default 64)
+    FUNCTION_QUEUE_TIMEOUT  seconds a request may wait for a slot (default 1)
+    FUNCTION_RETRY_AFTER    Retry-After of the 503, in seconds (default 1)
+"""
+from collections import deque
+import asyncio
+import os
+import threading
+
+import function_metrics
+
+CONCURRENCY = int(os.getenv("FUNCTION_CONCURRENCY", 0))
+QUEUE_SIZE = int(os.getenv("FUNCTION_QUEUE", 64))
+QUEUE_TIMEOUT = float(os.getenv("FUNCTION_QUEUE_TIMEOUT", 1))
+RETRY_AFTER = int(os.getenv("FUNCTION_RETRY_AFTER", 1))
+
+# outcomes of enter()
+ADMITTED, QUEUE_FULL, TIMEOUT = "admitted", "queue_full", "timeout"
+SHED_FIELDS = {QUEUE_FULL: function_metrics.SHED_QUEUE_FULL, TIMEOUT: function_metrics.SHED_TIMEOUT}
+
+
+def shed_body(name):
+    return ("Service Unavailable: %s is overloaded, retry in %ds\n" % (name, RETRY_AFTER)).encode("utf-8")
+
+
+def shed_response(name):
+    """The complete 503 response the loop writes for a shed request."""
+    body = shed_body(name)
+    head = ("HTTP/1.1 503 Service Unavailable\r\n"
+            "Content-Type: text/plain; charset=utf-8\r\n"
+            "Content-Length: %d\r\n"
+            "Retry-After: %d\r\n"
+            "Connection: close\r\n\r\n" % (len(body), RETRY_AFTER))
+    return head.encode("latin-1") + body
+
+
+class Admission:
+    def __init__(self, name, limit, queue_size=QUEUE_SIZE, timeout=QUEUE_TIMEOUT):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.running = 0
+
+    def record(self, outcome):
+        metrics = function_metrics.METRICS
+        if metrics is None or self.name not in metrics.offsets:
+            return
+        if outcome == ADMITTED:
+            metrics.add(self.name, function_metrics.ADMITTED)
+        else:
+            metrics.add(self.name, SHED_FIELDS[outcome])
+
+    def queued(self, delta):
+        metrics = function_metrics.METRICS
+        if metrics is not None and self.name in metrics.offsets:
+            metrics.add(self.name, function_metrics.QUEUED, delta)
+
+
+class AsyncAdmission(Admission):
+    """Admission on the event loop; only ever used from the loop's thread."""
+
+    def __init__(self, name, limit, loop, queue_size=QUEUE_SIZE, timeout=QUEUE_TIMEOUT):
+        super().__init__(name, limit, queue_size, timeout)
+        self.loop = loop
+        self.waiters = deque()  # futures, resolved True when handed a slot
+
+    async def enter(self):
+        outcome = await self.wait()
+        self.record(outcome)
+        return outcome
+
+    async def wait(self):
+        if self.running < self.limit and not self.waiters:
+            self.running += 1
+            return ADMITTED
+        if len(self.waiters) >= self.queue_size:
+            return QUEUE_FULL
+        waiter = self.loop.create_future()
+        self.waiters.append(waiter)
+        timer = self.loop.call_later(self.timeout, self.expire, waiter)
+        self.queued(1)
+        try:
+            # leave() hands its slot over, so running is already counted
+            return ADMITTED if await waiter else TIMEOUT
+        except asyncio.CancelledError:
+            # the request went away: give back a slot handed over meanwhile,
+            # or leave the queue so it does not hold a place there
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                self.leave()
+            elif waiter in self.waiters:
+                self.waiters.remove(waiter)
+            raise
+        finally:
+            timer.cancel()
+            self.queued(-1)
+
+    def expire(self, waiter):
+        if not waiter.done():
+            waiter.set_result(False)
+            self.waiters.remove(waiter)
+
+    def leave(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.running -= 1
+
+
+class ThreadAdmission(Admission):
+    """Admission for handler threads."""
+
+    def __init__(self, name, limit, queue_size=QUEUE_SIZE, timeout=QUEUE_TIMEOUT):
+        super().__init__(name, limit, queue_size, timeout)
+        self.condition = threading.Condition()
+        self.waiting = 0
+
+    def enter(self):
+        outcome = self.wait()
+        self.record(outcome)
+        return outcome
+
+    def wait(self):
+        with self.condition:
+            if self.running < self.limit and not self.waiting:
+                self.running += 1
+                return ADMITTED
+            if self.waiting >= self.queue_size:
+                return QUEUE_FULL
+            self.waiting += 1
+            self.queued(1)
+            try:
+                if not self.condition.wait_for(lambda: self.running < self.limit, self.timeout):
+                    return TIMEOUT
+            finally:
+                self.waiting -= 1
+                self.queued(-1)
+            self.running += 1
+            return ADMITTED
+
+    def leave(self):
+        with self.condition:
+            self.running -= 1
+            self.condition.notify()
+
+
+THREAD_ADMISSIONS = {}  # limit key -> ThreadAdmission
+THREAD_ADMISSIONS_LOCK = threading.Lock()
+
+
+def thread_admission(key, limit):
+    """The shared ThreadAdmission of ``key``, created on first use."""
+    with THREAD_ADMISSIONS_LOCK:
+        if key not in THREAD_ADMISSIONS:
+            THREAD_ADMISSIONS[key] = ThreadAdmission(key, limit)
+        return THREAD_ADMISSIONS[key]
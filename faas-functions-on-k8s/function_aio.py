@@ -0,0 +1,233 @@
+"""asyncio front end for the function web servers.
+
+``AsyncHTTPServer`` has the same interface as ``http.server.HTTPServer``, so
+``function_runtime.serve()`` can run any ``FunctionServer`` handler on it,
+pre-forked or not. One long-lived event loop per worker accepts
+connections, waits for request heads and keeps idle HTTP/1.1 connections
+open without holding a thread. Each request is then handled by the
+unchanged handler class on an executor thread, with the CPU-bound function
+off the loop. The handler's rfile and wfile are bridged to the connection's
+stream reader and writer, so streamed request and response bodies still
+flow while the handler runs, with the writer applying backpressure.
+
+Configuration (environment variables):
+    FUNCTION_AIO_THREADS     executor threads per worker (default 4)
+    FUNCTION_AIO_KEEPALIVE   seconds an idle connection is kept (default 75)
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import re
+import socket
+import threading
+import time
+import traceback
+
+import function_admission
+
+EXECUTOR_THREADS = int(os.getenv("FUNCTION_AIO_THREADS", 4))
+KEEPALIVE_TIMEOUT = float(os.getenv("FUNCTION_AIO_KEEPALIVE", 75))
+MAX_HEAD_SIZE = 64 * 1024
+
+CONTENT_LENGTH = re.compile(rb"\r\ncontent-length[ \t]*:[ \t]*(\d+)[ \t]*\r\n", re.IGNORECASE)
+TRANSFER_ENCODING = re.compile(rb"\r\ntransfer-encoding[ \t]*:", re.IGNORECASE)
+
+
+class LoopReader(io.RawIOBase):
+    """Request stream for a handler thread: the head, then the body from the loop."""
+
+    def __init__(self, head, length, reader, loop):
+        self.head = memoryview(head)
+        self.remaining = length
+        self.reader = reader
+        self.loop = loop
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        if self.head:
+            n = min(len(b), len(self.head))
+            b[:n] = self.head[:n]
+            self.head = self.head[n:]
+            return n
+        if self.remaining <= 0:
+            return 0
+        # never read past this request's body, the next request may follow
+        data = asyncio.run_coroutine_threadsafe(self.reader.read(min(len(b), self.remaining)), self.loop).result()
+        n = len(data)
+        b[:n] = data
+        self.remaining -= n
+        if not n:
+            self.remaining = 0
+        return n
+
+
+class LoopWriter(io.RawIOBase):
+    """Response stream for a handler thread that writes through the loop."""
+
+    def __init__(self, writer, loop):
+        self.writer = writer
+        self.loop = loop
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        # b stays valid until we return, and the transport copies what it buffers
+        asyncio.run_coroutine_threadsafe(self.send(b), self.loop).result()
+        return len(b)
+
+    async def send(self, b):
+        self.writer.write(b)
+        await self.writer.drain()
+
+
+class AsyncHTTPServer:
+    """Drop-in replacement for HTTPServer that serves on an asyncio loop."""
+    address_family = socket.AF_INET
+    request_queue_size = 128
+    allow_reuse_address = True
+    executor_threads = EXECUTOR_THREADS
+
+    def __init__(self, server_address, RequestHandlerClass, bind_and_activate=True):
+        self.server_address = server_address
+        self.RequestHandlerClass = RequestHandlerClass
+        self.socket = socket.socket(self.address_family, socket.SOCK_STREAM)
+        self.executor = ThreadPoolExecutor(max_workers=self.executor_threads)
+        self.loop = None
+        self.stopping = None
+        self.stopped = threading.Event()
+        self.idle = set()
+        self.active = 0
+        self.admissions = {}  # limit key -> function_admission.AsyncAdmission or None
+        if bind_and_activate:
+            try:
+                self.server_bind()
+                self.server_activate()
+            except BaseException:
+                self.server_close()
+                raise
+
+    def server_bind(self):
+        if self.allow_reuse_address:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(self.server_address)
+        self.server_address = self.socket.getsockname()
+        host, port = self.server_address[:2]
+        self.server_name = socket.getfqdn(host)
+        self.server_port = port
+
+    def server_activate(self):
+        self.socket.listen(self.request_queue_size)
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def serve_forever(self, poll_interval=None):
+        self.loop = asyncio.new_event_loop()
+        try:
+            self.loop.run_until_complete(self.serve())
+        finally:
+            self.loop.close()
+            self.stopped.set()
+
+    def shutdown(self):
+        """Stop accepting, finish in-flight requests and close idle connections."""
+        if self.loop is not None and not self.stopped.is_set():
+            self.loop.call_soon_threadsafe(self.begin_stop)
+            self.stopped.wait()
+
+    def server_close(self):
+        self.socket.close()
+        self.executor.shutdown(wait=False)
+
+    def begin_stop(self):
+        self.stopping.set()
+        for writer in list(self.idle):
+            writer.close()
+
+    async def serve(self):
+        self.stopping = asyncio.Event()
+        server = await asyncio.start_server(self.handle_connection, sock=self.socket, limit=MAX_HEAD_SIZE)
+        await self.stopping.wait()
+        # closing the server also closes the listening socket
+        server.close()
+        while self.active or self.idle:
+            await asyncio.sleep(0.05)
+
+    def admission(self, key):
+        """The admission control of requests with limit ``key``, if they have a limit."""
+        if key is None:
+            return None
+        if key not in self.admissions:
+            limit = self.RequestHandlerClass.concurrency_limit(key)
+            self.admissions[key] = function_admission.AsyncAdmission(key, limit, self.loop) if limit else None
+        return self.admissions[key]
+
+    async def handle_connection(self, reader, writer):
+        client_address = writer.get_extra_info("peername")
+        try:
+            while not self.stopping.is_set():
+                self.idle.add(writer)
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        asyncio.TimeoutError, ConnectionError):
+                    break
+                finally:
+                    self.idle.discard(writer)
+
+                received_at = time.perf_counter()
+                match = CONTENT_LENGTH.search(head)
+                length = int(match.group(1)) if match else 0
+                admission = self.admission(self.RequestHandlerClass.limit_key(head))
+                self.active += 1
+                try:
+                    # over the limit, requests wait here on the loop rather
+                    # than holding an executor thread, or are shed from here
+                    if admission is not None and await admission.enter() != function_admission.ADMITTED:
+                        writer.write(function_admission.shed_response(admission.name))
+                        await writer.drain()
+                        break
+                    try:
+                        keep_alive = await self.loop.run_in_executor(
+                            self.executor, self.handle_request_in_thread, head, length, reader, writer, client_address, received_at)
+                    finally:
+                        if admission is not None:
+                            admission.leave()
+                finally:
+                    self.active -= 1
+                # a body we cannot frame leaves the stream position unknown
+                if not keep_alive or TRANSFER_ENCODING.search(head):
+                    break
+        finally:
+            self.idle.discard(writer)
+            writer.close()
+
+    def handle_request_in_thread(self, head, length, reader, writer, client_address, received_at):
+        """Run one request through the handler class; True to keep the connection."""
+        handler = self.RequestHandlerClass.__new__(self.RequestHandlerClass)
+        handler.server = self
+        handler.request = None
+        handler.client_address = client_address
+        # the time spent waiting for an executor thread shows up as queue wait
+        handler.received_at = received_at
+        # admission control already happened on the loop
+        handler.admitted_by_frontend = True
+        handler.close_connection = True
+        raw_reader = LoopReader(head, length, reader, self.loop)
+        handler.rfile = io.BufferedReader(raw_reader)
+        handler.wfile = io.BufferedWriter(LoopWriter(writer, self.loop), buffer_size=64 * 1024)
+        try:
+            handler.handle_one_request()
+            handler.wfile.flush()
+        except ConnectionError:
+            return False
+        except Exception:
+            print("Exception while handling a request from %s:" % (client_address,))
+            traceback.print_exc()
+            return False
+        # an unread body would be taken for the next request
+        return not handler.close_connection and raw_reader.remaining == 0
@@ -0,0 +1,174 @@
+"""Bounded in-process LRU cache shared across the requests of a worker.
+
+The cache is bounded both by entry count and by an estimate of the memory
+its keys and values hold, entries can expire after a TTL, and it counts
+hits, misses and evictions so the servers can report how effective it is.
+
+``Memo`` builds on it to memoize deterministic function results by function
+name and normalized parameters, each with an ETag derived from the result.
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import mmap
+import sys
+import threading
+import time
+
+# rough cost of the OrderedDict node, the key/value references and a small
+# value tuple on top of what sys.getsizeof reports for the key
+ENTRY_OVERHEAD = 200
+
+
+def entry_size(key, value=None):
+    size = ENTRY_OVERHEAD + sys.getsizeof(key)
+    if isinstance(value, (bytes, bytearray, str)):
+        size += sys.getsizeof(value)
+    return size
+
+
+class LRUCache:
+    def __init__(self, max_bytes=16 * 1024 * 1024, max_entries=None, ttl=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, size, expiry time or None)
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                del self.entries[key]
+                self.bytes -= entry[1]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        if size is None:
+            size = entry_size(key, value)
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self.entries[key] = (value, size, expires)
+            self.bytes += size
+            while self.bytes > self.max_bytes or (self.max_entries and len(self.entries) > self.max_entries):
+                _, (_, evicted, _) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    def invalidate(self, predicate=None):
+        """Drop the entries whose key matches ``predicate`` (all if None); the count dropped."""
+        with self.lock:
+            keys = [key for key in self.entries if predicate is None or predicate(key)]
+            for key in keys:
+                self.bytes -= self.entries.pop(key)[1]
+            return len(keys)
+
+    def clear(self):
+        self.invalidate()
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+            }
+
+
+def result_etag(result):
+    """Weak ETag of a result: its representation depends on the Accept header."""
+    digest = hashlib.sha1(json.dumps(result, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+    return 'W/"%s"' % digest[:20]
+
+
+class Memo:
+    """Results of deterministic functions, keyed by function name and parameters."""
+
+    def __init__(self, cache, enabled=True):
+        self.cache = cache
+        self.enabled = enabled
+        # invalidation counter shared with the workers forked after this;
+        # a worker that sees it change drops its whole memo
+        self.generation = mmap.mmap(-1, 8)
+        self.seen = 0
+
+    def shared_generation(self):
+        return int.from_bytes(self.generation[:8], "little")
+
+    def check_generation(self):
+        generation = self.shared_generation()
+        if generation != self.seen:
+            self.seen = generation
+            self.cache.invalidate()
+
+    @staticmethod
+    def key(name, params):
+        return (name, tuple(sorted(params.items())))
+
+    def call(self, name, kernel, params=None, bypass=False):
+        """``(result, etag)`` of ``kernel(**params)``, from the cache unless bypassed."""
+        if not self.enabled or bypass:
+            result = kernel(**(params or {}))
+            return result, result_etag(result)
+        entry = self.cached(name, params)
+        return entry if entry is not None else self.compute(name, kernel, params)
+
+    def cached(self, name, params=None):
+        """The memoized ``(result, etag)`` of ``name``, or None; counts a hit or a miss."""
+        if not self.enabled:
+            return None
+        self.check_generation()
+        return self.cache.get(self.key(name, params or {}))
+
+    def compute(self, name, kernel, params=None):
+        """Run ``kernel(**params)`` and memoize it, after cached() missed; ``(result, etag)``."""
+        params = params or {}
+        result = kernel(**params)
+        entry = (result, result_etag(result))
+        if self.enabled:
+            key = self.key(name, params)
+            self.cache.put(key, entry, entry_size(key) + sys.getsizeof(json.dumps(result, default=str)))
+        return entry
+
+    def invalidate(self, name=None):
+        """Forget the results of ``name``, or of every function; the count dropped here.
+
+        The other workers drop all of their results on their next call.
+        """
+        self.check_generation()
+        count = self.cache.invalidate(None if name is None else lambda key: key[0] == name)
+        self.seen = self.shared_generation() + 1
+        self.generation[:8] = self.seen.to_bytes(8, "little")
+        return count
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats['enabled'] = self.enabled
+        return stats
@@ -0,0 +1,187 @@
+"""Prometheus metrics of the function servers, kept in shared memory.
+
+The serving runtime allocates one anonymous shared mapping before it forks,
+with a fixed slot of counters per worker process and preallocated histogram
+buckets per function. A worker only ever writes its own slot, so recording
+a request takes no lock shared between processes (the per-worker lock only
+orders that worker's handler threads). ``GET /metrics`` can be answered by
+any worker: it adds up the slots of all workers.
+
+Per function:
+    function_queue_wait_seconds      head received until a handler thread
+                                     picked the request up (asyncio front end)
+    function_execution_seconds       request parsed until the response started
+    function_response_write_seconds  response started until it was flushed
+    function_requests_total, function_request_bytes_total,
+    function_response_bytes_total, function_requests_in_flight
+    function_admitted_total, function_shed_total{reason="queue_full|timeout"},
+    function_queue_length            admission control (function_admission)
+Per worker:
+    process_resident_memory_bytes
+"""
+from bisect import bisect_left
+import mmap
+import os
+import threading
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HISTOGRAMS = (
+    ("function_queue_wait_seconds", "Time a request waited for a handler thread after its head arrived."),
+    ("function_execution_seconds", "Time from parsing a request to the start of its response."),
+    ("function_response_write_seconds", "Time from the start of a response until it was flushed."),
+)
+# (metric, type, help, extra labels); a metric may span consecutive entries
+COUNTERS = (
+    ("function_requests_total", "counter", "Requests handled.", ""),
+    ("function_request_bytes_total", "counter", "Request body bytes received.", ""),
+    ("function_response_bytes_total", "counter", "Response bytes sent, status line and headers included.", ""),
+    ("function_requests_in_flight", "gauge", "Requests being handled.", ""),
+    ("function_admitted_total", "counter", "Requests let through admission control.", ""),
+    ("function_shed_total", "counter", "Requests rejected with 503 by admission control.", 'reason="queue_full"'),
+    ("function_shed_total", "counter", "Requests rejected with 503 by admission control.", 'reason="timeout"'),
+    ("function_queue_length", "gauge", "Requests waiting for a concurrency slot.", ""),
+)
+
+# per histogram: one count per bucket, the +Inf bucket, then the sum
+HISTOGRAM_SIZE = len(BUCKETS) + 2
+QUEUE_WAIT, EXECUTION, RESPONSE_WRITE = (i * HISTOGRAM_SIZE for i in range(len(HISTOGRAMS)))
+(REQUESTS, REQUEST_BYTES, RESPONSE_BYTES, IN_FLIGHT,
+ ADMITTED, SHED_QUEUE_FULL, SHED_TIMEOUT, QUEUED) = (len(HISTOGRAMS) * HISTOGRAM_SIZE + i for i in range(len(COUNTERS)))
+FUNCTION_SIZE = len(HISTOGRAMS) * HISTOGRAM_SIZE + len(COUNTERS)
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class CountingWriter:
+    """Wraps a handler's wfile and counts the bytes written through it."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return self.raw.write(data)
+
+    def flush(self):
+        self.raw.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+class Metrics:
+    def __init__(self, functions, workers=1):
+        self.functions = tuple(functions)
+        self.offsets = {name: 1 + i * FUNCTION_SIZE for i, name in enumerate(self.functions)}
+        # slot layout: the worker's pid, then one block per function
+        self.slot_size = 1 + len(self.functions) * FUNCTION_SIZE
+        self.workers = workers
+        # anonymous and MAP_SHARED: forked workers write into the same pages
+        self.memory = mmap.mmap(-1, 8 * self.slot_size * workers)
+        self.values = memoryview(self.memory).cast("d")
+        self.attach(0)
+
+    def attach(self, worker):
+        """Make this process write to the slot of ``worker``."""
+        self.worker = worker
+        self.base = worker * self.slot_size
+        self.lock = threading.Lock()
+        self.values[self.base] = os.getpid()
+
+    def begin(self, function):
+        self.add(function, IN_FLIGHT)
+
+    def add(self, function, field, delta=1):
+        with self.lock:
+            self.values[self.base + self.offsets[function] + field] += delta
+
+    def finish(self, function, queue_wait, execution, write, request_bytes, response_bytes):
+        """Record a finished request; ``queue_wait`` is None when it is not known."""
+        values = self.values
+        offset = self.base + self.offsets[function]
+        with self.lock:
+            values[offset + IN_FLIGHT] -= 1
+            values[offset + REQUESTS] += 1
+            values[offset + REQUEST_BYTES] += request_bytes
+            values[offset + RESPONSE_BYTES] += response_bytes
+            for start, value in ((QUEUE_WAIT, queue_wait), (EXECUTION, execution), (RESPONSE_WRITE, write)):
+                if value is not None:
+                    values[offset + start + bisect_left(BUCKETS, value)] += 1
+                    values[offset + start + HISTOGRAM_SIZE - 1] += value
+
+    def totals(self, function):
+        """The block of ``function`` summed over all worker slots."""
+        offset = self.offsets[function]
+        totals = [0.0] * FUNCTION_SIZE
+        for worker in range(self.workers):
+            block = self.values[worker * self.slot_size + offset:worker * self.slot_size + offset + FUNCTION_SIZE]
+            totals = [a + b for a, b in zip(totals, block)]
+        return totals
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        blocks = [(name, self.totals(name)) for name in self.functions]
+
+        for h, (metric, help_text) in enumerate(HISTOGRAMS):
+            lines.append("# HELP %s %s" % (metric, help_text))
+            lines.append("# TYPE %s histogram" % metric)
+            for name, block in blocks:
+                start = h * HISTOGRAM_SIZE
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), block[start:start + HISTOGRAM_SIZE - 1]):
+                    cumulative += count
+                    lines.append('%s_bucket{function="%s",le="%s"} %d' % (metric, name, bound, cumulative))
+                lines.append('%s_sum{function="%s"} %r' % (metric, name, block[start + HISTOGRAM_SIZE - 1]))
+                lines.append('%s_count{function="%s"} %d' % (metric, name, cumulative))
+
+        previous = None
+        for c, (metric, kind, help_text, labels) in enumerate(COUNTERS):
+            if metric != previous:
+                lines.append("# HELP %s %s" % (metric, help_text))
+                lines.append("# TYPE %s %s" % (metric, kind))
+                previous = metric
+            for name, block in blocks:
+                label_text = 'function="%s"' % name + ("," + labels if labels else "")
+                lines.append('%s{%s} %d' % (metric, label_text, block[REQUESTS + c]))
+
+        lines.append("# HELP process_resident_memory_bytes Resident memory of each worker process.")
+        lines.append("# TYPE process_resident_memory_bytes gauge")
+        for worker in range(self.workers):
+            rss = resident_memory(int(self.values[worker * self.slot_size]))
+            if rss is not None:
+                lines.append('process_resident_memory_bytes{worker="%d"} %d' % (worker, rss))
+        return "\n".join(lines) + "\n"
+
+
+def resident_memory(pid):
+    if not pid:
+        return None
+    try:
+        with open("/proc/%d/statm" % pid) as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        if pid != os.getpid():
+            return None
+    # no procfs: peak RSS of this process is the closest we have
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+METRICS = None
+
+
+def setup(functions, workers=1):
+    """Allocate the shared metrics; call before forking the workers."""
+    global METRICS
+    METRICS = Metrics(functions, workers)
+    return METRICS
+
+
+def get(functions):
+    """The process metrics, allocated for one worker if serve() did not."""
+    if METRICS is None:
+        setup(functions)
+    return METRICS
@@ -0,0 +1,101 @@
+"""Registry of the functions one multi-function host process serves.
+
+Each entry names a function and holds its kernel, the request handler class
+of its own web server (which keeps the function's request/response
+contract) and how many of its requests may run at once.
+
+The images copy the shared modules next to the server scripts. In a checkout
+they live one directory up, and a server runs through this module:
+
+    python function_registry.py json/web-server-json.py
+"""
+from collections import OrderedDict
+import importlib.util
+import os
+import runpy
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CONCURRENCY = 4
+
+
+class FunctionEntry:
+    def __init__(self, name, kernel, handler_class, concurrency=DEFAULT_CONCURRENCY):
+        self.name = name
+        self.kernel = kernel
+        self.handler_class = handler_class
+        self.concurrency = concurrency
+
+    def describe(self):
+        return {
+            'name': self.name,
+            'route': "/%s/" % self.name,
+            'kernel': self.kernel.__name__,
+            'concurrency': self.concurrency,
+        }
+
+
+REGISTRY = OrderedDict()  # name -> FunctionEntry
+
+
+def register(name, kernel, handler_class, concurrency=None):
+    if name in REGISTRY:
+        raise ValueError("function %r is already registered" % name)
+    entry = FunctionEntry(name, kernel, handler_class, concurrency or DEFAULT_CONCURRENCY)
+    REGISTRY[name] = entry
+    return entry
+
+
+def lookup(name):
+    return REGISTRY.get(name)
+
+
+def parse_limits(spec):
+    """Parse "name=limit,name=limit" into a dict."""
+    limits = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        name, _, limit = item.partition("=")
+        try:
+            limits[name.strip()] = int(limit)
+        except ValueError:
+            raise ValueError("concurrency limit should look like name=N, got %r" % item)
+        if limits[name.strip()] < 1:
+            raise ValueError("concurrency limit of %s should be >= 1" % name.strip())
+    return limits
+
+
+def load_server(path):
+    """Import a ``web-server-*.py`` script, whose file name is not a module name."""
+    path = os.path.abspath(path)
+    # the script imports its helper modules from its own directory
+    directory = os.path.dirname(path)
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    module_name = os.path.splitext(os.path.basename(path))[0].replace("-", "_")
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    # registered first so pickling (the sentiment process pool) finds it
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_server(path):
+    """Run a ``web-server-*.py`` script of a checkout as __main__."""
+    path = os.path.abspath(path)
+    # its own directory first, then the shared modules
+    for directory in (HERE, os.path.dirname(path)):
+        if directory not in sys.path:
+            sys.path.insert(0, directory)
+    runpy.run_path(path, run_name="__main__")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("usage: python function_registry.py <function-dir>/web-server-<name>.py", file=sys.stderr)
+        sys.exit(2)
+    run_server(sys.argv[1])
@@ -0,0 +1,658 @@
+"""Shared serving runtime for the function web servers.
+
+Every ``web-server-*.py`` hands its request handler to ``serve()``. With one
+worker the server runs in-process like before; with more, the runtime
+pre-forks worker processes that each bind their own listening socket on the
+same port through SO_REUSEPORT, so the kernel spreads connections across
+cores. SIGTERM (what Kubernetes sends on pod shutdown) and SIGINT stop
+accepting, finish the in-flight request and drain already-queued
+connections before the worker exits.
+
+Configuration (environment variables):
+    FUNCTION_WORKERS        number of worker processes, or "auto" for one
+                            per available CPU (default 1)
+    FUNCTION_DRAIN_TIMEOUT  seconds a worker may spend draining (default 20)
+    FUNCTION_RESTART_DELAY  seconds before a dead worker is restarted; the
+                            delay doubles while it keeps dying, up to
+                            FUNCTION_RESTART_MAX_DELAY (defaults 0.1 and 10)
+    FUNCTION_CRASH_LIMIT    worker exits within FUNCTION_CRASH_WINDOW seconds
+                            after which the server stops with status 1, so
+                            the pod restarts (defaults 10 and 60)
+    FUNCTION_FRONTEND       "asyncio" to serve on function_aio.AsyncHTTPServer
+                            (what the functions use by default), "http" for
+                            a thread-per-connection DrainingHTTPServer
+    FUNCTION_MEMO           "1" to memoize the deterministic functions
+                            (base64 and primes) per worker (default off)
+    FUNCTION_MEMO_BYTES     memory bound of the memoized results (default 4 MiB)
+    FUNCTION_MEMO_TTL       seconds a memoized result is kept (default: no expiry)
+    FUNCTION_BENCHMARK      "1" to bypass the memo for every request, so raw
+                            compute is measured; a request can also bypass
+                            it with "Cache-Control: no-cache"
+
+``FunctionHandler`` is the shared response layer of the handlers: HTTP/1.1
+with persistent connections, each response assembled into one buffer with
+a Content-Length, and the result negotiated between the legacy HTML page
+and JSON (``Accept: application/json``). It also times every request into
+``function_metrics`` and answers ``GET /metrics`` for all functions,
+``GET /ready`` once the startup phases of ``function_startup`` are done, and
+``GET /memo`` / ``DELETE /memo[?function=name]`` for the memoized results.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import json
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+
+import function_admission
+import function_cache
+import function_metrics
+import function_startup
+
+DEFAULT_WORKERS = 1
+DEFAULT_DRAIN_TIMEOUT = 20.0
+DEFAULT_RESTART_DELAY = 0.1
+DEFAULT_RESTART_MAX_DELAY = 10.0
+DEFAULT_CRASH_LIMIT = 10
+DEFAULT_CRASH_WINDOW = 60.0
+
+MEMO = function_cache.Memo(
+    function_cache.LRUCache(max_bytes=int(os.getenv("FUNCTION_MEMO_BYTES", 4 * 1024 * 1024)),
+                            ttl=float(os.getenv("FUNCTION_MEMO_TTL", 0)) or None),
+    enabled=os.getenv("FUNCTION_MEMO", "0") == "1")
+BENCHMARK_MODE = os.getenv("FUNCTION_BENCHMARK", "0") == "1"
+
+
+def worker_count(workers=None):
+    """Resolve the worker count from the argument or $FUNCTION_WORKERS."""
+    if workers is None:
+        workers = os.getenv("FUNCTION_WORKERS", str(DEFAULT_WORKERS))
+    if str(workers).lower() == "auto":
+        try:
+            return len(os.sched_getaffinity(0))
+        except AttributeError:
+            return os.cpu_count() or 1
+    workers = int(workers)
+    if workers < 1:
+        raise ValueError("FUNCTION_WORKERS must be >= 1 or 'auto', got %d" % workers)
+    return workers
+
+
+def drain_timeout():
+    return float(os.getenv("FUNCTION_DRAIN_TIMEOUT", DEFAULT_DRAIN_TIMEOUT))
+
+
+def restart_policy():
+    """(first delay, max delay, crash limit, crash window) of the worker restarts."""
+    return (float(os.getenv("FUNCTION_RESTART_DELAY", DEFAULT_RESTART_DELAY)),
+            float(os.getenv("FUNCTION_RESTART_MAX_DELAY", DEFAULT_RESTART_MAX_DELAY)),
+            int(os.getenv("FUNCTION_CRASH_LIMIT", DEFAULT_CRASH_LIMIT)),
+            float(os.getenv("FUNCTION_CRASH_WINDOW", DEFAULT_CRASH_WINDOW)))
+
+
+def has_reuse_port():
+    return hasattr(socket, "SO_REUSEPORT")
+
+
+def make_server(server_class, address, handler_class, reuse_port=False):
+    """Build ``server_class`` and bind it, with SO_REUSEPORT if requested."""
+    httpd = server_class(address, handler_class, bind_and_activate=False)
+    try:
+        if reuse_port:
+            httpd.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        httpd.allow_reuse_address = True
+        httpd.server_bind()
+        httpd.server_activate()
+    except BaseException:
+        httpd.server_close()
+        raise
+    return httpd
+
+
+class DrainingHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer whose shutdown lets the running requests finish.
+
+    Handler threads stay daemons, so a stuck request cannot hold the worker
+    past the drain deadline, but they are tracked: finish() closes the idle
+    keep-alive connections, makes busy ones close after their response and
+    joins the threads until the deadline.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connection_lock = threading.Lock()
+        # request socket -> None before its first request, then whether one is running
+        self.connections = {}
+        self.handler_threads = set()
+        self.draining = False
+
+    def process_request(self, request, client_address):
+        thread = threading.Thread(target=self.process_request_thread, args=(request, client_address), daemon=True)
+        with self.connection_lock:
+            self.connections[request] = None
+            self.handler_threads.add(thread)
+        thread.start()
+
+    def process_request_thread(self, request, client_address):
+        try:
+            super().process_request_thread(request, client_address)
+        finally:
+            with self.connection_lock:
+                self.connections.pop(request, None)
+                self.handler_threads.discard(threading.current_thread())
+
+    def request_running(self, request, running):
+        """Record whether ``request`` runs a request; True once the server is draining."""
+        with self.connection_lock:
+            if request in self.connections:
+                self.connections[request] = running
+            return self.draining
+
+    def finish(self, deadline):
+        with self.connection_lock:
+            self.draining = True
+            idle = [request for request, running in self.connections.items() if running is False]
+            threads = list(self.handler_threads)
+        for request in idle:
+            # wakes the handler blocked reading the next request, which then sees EOF
+            try:
+                request.shutdown(socket.SHUT_RD)
+            except OSError:
+                pass
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+
+def serve_worker(httpd):
+    """Serve on ``httpd`` until SIGTERM/SIGINT, then drain and close it."""
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        if stopping.is_set():
+            return
+        stopping.set()
+        # shutdown() blocks until serve_forever() returns, and the signal
+        # handler runs on the thread that is inside serve_forever()
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    deadline = time.monotonic() + drain_timeout()
+    drain(httpd, deadline)
+    if hasattr(httpd, "finish"):
+        httpd.finish(deadline)
+    httpd.server_close()
+
+
+def drain(httpd, deadline):
+    """Handle connections that are already queued on the listening socket."""
+    if not hasattr(httpd, "handle_request"):
+        # the asyncio front end drains inside serve_forever()
+        return
+    httpd.timeout = 0
+    while time.monotonic() < deadline:
+        try:
+            ready, _, _ = select.select([httpd], [], [], 0)
+        except (OSError, ValueError):
+            return
+        if not ready:
+            return
+        httpd.handle_request()
+
+
+def start_warm_up(handler_class):
+    """Warm the worker up in the background, then report it ready (or failed)."""
+    def warm_up():
+        try:
+            with function_startup.phase("warm_up"):
+                handler_class.warm_up()
+        except Exception:
+            # the worker keeps serving, but /ready stays 503 so the pod gets
+            # no traffic it may not be able to handle
+            print("Warm-up failed:")
+            traceback.print_exc()
+            function_startup.mark_failed()
+            return
+        function_startup.mark_ready()
+
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+
+def frontend_server_class(server_class):
+    """Apply the $FUNCTION_FRONTEND override to ``server_class``."""
+    frontend = os.getenv("FUNCTION_FRONTEND", "").lower()
+    if frontend == "asyncio":
+        import function_aio
+        return function_aio.AsyncHTTPServer
+    if frontend == "http":
+        # one connection per thread: a kept-alive client must not block the rest
+        return DrainingHTTPServer
+    if frontend:
+        raise ValueError("FUNCTION_FRONTEND must be 'asyncio' or 'http', got %r" % frontend)
+    return server_class
+
+
+def serve(handler_class, server_class=DrainingHTTPServer, address=("0.0.0.0", 8000), workers=None):
+    """Run ``handler_class`` on ``address`` with ``workers`` processes."""
+    function_startup.imports_done()
+    workers = worker_count(workers)
+    server_class = frontend_server_class(server_class)
+    # before forking, so the workers share what is loaded and the same
+    # metrics and readiness pages
+    with function_startup.phase("preload"):
+        handler_class.preload()
+    function_startup.setup(workers)
+    metrics = function_metrics.setup(handler_class.metric_functions(), workers)
+    print("Launching server on %s:%d with %d worker(s)..." % (address[0] or "0.0.0.0", address[1], workers))
+
+    if workers == 1:
+        httpd = make_server(server_class, address, handler_class)
+        start_warm_up(handler_class)
+        serve_worker(httpd)
+        print("\nServer stopped.")
+        return
+
+    # without SO_REUSEPORT the workers share one socket bound before forking
+    shared = None
+    if not has_reuse_port():
+        shared = make_server(server_class, address, handler_class)
+
+    def spawn(worker):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            metrics.attach(worker)
+            function_startup.attach(worker)
+            code = 0
+            try:
+                httpd = shared or make_server(server_class, address, handler_class, reuse_port=True)
+                start_warm_up(handler_class)
+                serve_worker(httpd)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        return pid
+
+    children = {}  # pid -> worker index
+    stopping = []
+    first_delay, max_delay, crash_limit, crash_window = restart_policy()
+    started = {}  # worker index -> when it was spawned
+    delays = {}  # worker index -> its last restart delay
+    restarts = {}  # worker index -> when to spawn it again
+    exits = []  # when workers died on their own, within the crash window
+    crashed = False
+
+    def stop(signum, frame):
+        if not stopping:
+            stopping.append(time.monotonic() + drain_timeout())
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    def start(worker):
+        started[worker] = time.monotonic()
+        children[spawn(worker)] = worker
+
+    for worker in range(workers):
+        start(worker)
+
+    while children or (restarts and not stopping):
+        if not stopping:
+            for worker, due in list(restarts.items()):
+                if due <= time.monotonic():
+                    del restarts[worker]
+                    start(worker)
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG if stopping or restarts else 0)
+        except ChildProcessError:
+            pid = 0
+        except InterruptedError:
+            continue
+        if pid == 0:
+            if stopping and time.monotonic() > stopping[0]:
+                for pid in children:
+                    os.kill(pid, signal.SIGKILL)
+                stopping[0] = float("inf")
+            time.sleep(0.05)
+            continue
+        worker = children.pop(pid, None)
+        if not stopping and worker is not None:
+            # a worker died on its own, keep the pool at full size; the
+            # replacement keeps adding to its counters
+            now = time.monotonic()
+            exits = [t for t in exits if now - t < crash_window] + [now]
+            if len(exits) >= crash_limit:
+                print("Worker %d exited with status %d, %d exits in %gs, stopping." % (
+                    pid, status, len(exits), crash_window))
+                crashed = True
+                stop(signal.SIGTERM, None)
+                continue
+            # back off while the slot keeps dying right after it starts
+            if now - started[worker] < crash_window and worker in delays:
+                delays[worker] = min(delays[worker] * 2, max_delay)
+            else:
+                delays[worker] = first_delay
+            print("Worker %d exited with status %d, restarting in %gs." % (pid, status, delays[worker]))
+            restarts[worker] = now + delays[worker]
+
+    if shared is not None:
+        shared.server_close()
+    print("\nServer stopped.")
+    if crashed:
+        sys.exit(1)
+
+
+def read_body(rfile, length, buffer):
+    """Yield the ``length``-byte request body as views into ``buffer``.
+
+    Every view but the last fills the whole buffer, and each one is only
+    valid until the next is requested.
+    """
+    view = memoryview(buffer)
+    remaining = length
+    while remaining > 0:
+        want = min(len(view), remaining)
+        filled = 0
+        while filled < want:
+            n = rfile.readinto(view[filled:want])
+            if not n:
+                raise ConnectionError("request body ended after %d of %d bytes" % (length - remaining + filled, length))
+            filled += n
+        remaining -= filled
+        yield view[:filled]
+
+
+class ChunkedWriter:
+    """Write a response body with HTTP/1.1 chunked transfer encoding.
+
+    Each chunk costs two writes: the size line (carrying the CRLF that ends
+    the previous chunk) and the data itself, which is passed through
+    without copying.
+    """
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.started = False
+        self.bytes_written = 0
+
+    def write(self, data):
+        if not data:
+            return
+        prefix = b"%X\r\n" % len(data)
+        self.wfile.write(b"\r\n" + prefix if self.started else prefix)
+        self.wfile.write(data)
+        self.started = True
+        self.bytes_written += len(data)
+
+    def close(self, trailers=None):
+        """End the body, optionally with trailer fields announced in a Trailer header."""
+        end = b"0\r\n"
+        for name, value in (trailers or {}).items():
+            end += ("%s: %s\r\n" % (name, value)).encode("latin-1")
+        end += b"\r\n"
+        self.wfile.write(b"\r\n" + end if self.started else end)
+        self.wfile.flush()
+
+
+def request_line(head):
+    """(method, path without query) of a raw request line or head."""
+    parts = head.split(b" ", 2)
+    if len(parts) < 2:
+        return None, None
+    return parts[0].decode("latin-1"), parts[1].decode("latin-1").partition("?")[0]
+
+
+HTML_HEAD = "<html>\n<head><title>%s</title></head>\n<body>\n"
+HTML_TAIL = "</body>\n</html>"
+
+
+def render_html(paragraphs, title="Function Execution Results"):
+    """The legacy result page: one <p> per entry of ``paragraphs``."""
+    return HTML_HEAD % title + "".join("<p>%s</p>\n" % p for p in paragraphs) + HTML_TAIL
+
+
+def accepted_types(accept):
+    """Map each media range of an Accept header to its q value."""
+    types = {}
+    for part in accept.split(","):
+        fields = part.split(";")
+        media_type = fields[0].strip().lower()
+        if not media_type:
+            continue
+        q = 1.0
+        for field in fields[1:]:
+            name, _, value = field.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        types[media_type] = q
+    return types
+
+
+def prefers_json(accept):
+    """True if ``accept`` ranks application/json above text/html."""
+    if not accept or "json" not in accept:
+        return False
+    types = accepted_types(accept)
+
+    def quality(media_type):
+        major = media_type.split("/")[0]
+        for candidate in (media_type, major + "/*", "*/*"):
+            if candidate in types:
+                return types[candidate]
+        return 0.0
+
+    json_q = quality("application/json")
+    return json_q > 0 and json_q > quality("text/html")
+
+
+class FunctionHandler(BaseHTTPRequestHandler):
+    """Base class of the function request handlers."""
+    protocol_version = "HTTP/1.1"
+    # buffer writes so the header block and a body leave in one send
+    wbufsize = 64 * 1024
+    html_title = "Function Execution Results"
+    # label of this handler's requests in /metrics
+    function_name = "function"
+    # set by the asyncio front end when the request head arrived
+    received_at = None
+    request_started = None
+    response_started = None
+    # the asyncio front end admits requests on its loop, before the handler
+    admitted_by_frontend = False
+    # ThreadAdmission holding a slot for the current request
+    admission = None
+
+    # requests the runtime answers itself, outside the function's metrics
+    runtime_paths = {
+        ("GET", "/metrics"): "METRICS",
+        ("GET", "/ready"): "READY",
+        ("GET", "/memo"): "MEMO",
+        ("DELETE", "/memo"): "MEMO_INVALIDATE",
+    }
+
+    @classmethod
+    def metric_functions(cls):
+        return (cls.function_name,)
+
+    @classmethod
+    def limit_key(cls, head):
+        """Key of the concurrency limit a raw request head falls under, or None."""
+        # probes and scrapes must get through to an overloaded server
+        if not function_admission.CONCURRENCY or request_line(head) in cls.runtime_paths:
+            return None
+        return cls.function_name
+
+    @classmethod
+    def concurrency_limit(cls, key):
+        return function_admission.CONCURRENCY
+
+    @classmethod
+    def preload(cls):
+        """Load what the function needs, before the workers are forked."""
+
+    @classmethod
+    def warm_up(cls):
+        """Invoke the function once in a freshly started worker."""
+
+    def handle_one_request(self):
+        self.request_started = None
+        self.response_started = None
+        self.admission = None
+        if not isinstance(self.wfile, function_metrics.CountingWriter):
+            self.wfile = function_metrics.CountingWriter(self.wfile)
+        try:
+            super().handle_one_request()
+        finally:
+            if self.draining(False):
+                self.close_connection = True
+            if self.request_started is not None:
+                self.record_request()
+            if self.admission is not None:
+                self.admission.leave()
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        if self.draining(True):
+            self.close_connection = True
+        runtime_command = self.runtime_paths.get((self.command, self.path.split("?")[0]))
+        if runtime_command:
+            # served by the do_<runtime_command> method below
+            self.command = runtime_command
+            return True
+        if not self.admitted_by_frontend and not self.admit():
+            return False
+        if not self.route():
+            return False
+        self.request_started = time.perf_counter()
+        self.bytes_before = self.wfile.bytes_written
+        function_metrics.get(self.metric_functions()).begin(self.function_name)
+        return True
+
+    def draining(self, running):
+        """Tell a DrainingHTTPServer whether a request runs; True when it is shutting down."""
+        request_running = getattr(self.server, "request_running", None)
+        return request_running(self.request, running) if request_running else False
+
+    def admit(self):
+        """Thread-side admission control; False once the 503 was sent."""
+        key = type(self).limit_key(self.raw_requestline)
+        limit = type(self).concurrency_limit(key) if key is not None else None
+        if not limit:
+            return True
+        admission = function_admission.thread_admission(key, limit)
+        if admission.enter() == function_admission.ADMITTED:
+            self.admission = admission
+            return True
+        self.close_connection = True
+        self.send_body(function_admission.shed_body(key), "text/plain; charset=utf-8", 503,
+                       {"Retry-After": str(function_admission.RETRY_AFTER), "Connection": "close"})
+        return False
+
+    def route(self):
+        """Prepare the request for dispatch; False once an error response was sent."""
+        return True
+
+    def send_response(self, code, message=None):
+        if self.response_started is None:
+            self.response_started = time.perf_counter()
+        super().send_response(code, message)
+
+    def record_request(self):
+        end = time.perf_counter()
+        response_started = self.response_started or end
+        queue_wait = None
+        if self.received_at is not None:
+            queue_wait = max(0.0, self.request_started - self.received_at)
+        try:
+            request_bytes = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            request_bytes = 0
+        function_metrics.get(self.metric_functions()).finish(
+            self.function_name, queue_wait, response_started - self.request_started, end - response_started,
+            request_bytes, self.wfile.bytes_written - self.bytes_before)
+
+    def do_METRICS(self):
+        text = function_metrics.get(self.metric_functions()).render() + function_startup.render_metrics()
+        self.send_body(text.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
+
+    def do_MEMO(self):
+        stats = MEMO.stats()
+        stats['benchmark_mode'] = BENCHMARK_MODE
+        self.send_body(json.dumps(stats).encode("utf-8"), "application/json")
+
+    def do_MEMO_INVALIDATE(self):
+        name = parse_qs(urlparse(self.path).query).get('function', [None])[0]
+        body = json.dumps({'invalidated': MEMO.invalidate(name)}).encode("utf-8")
+        self.send_body(body, "application/json")
+
+    def do_READY(self):
+        # 503 until every worker has warmed up, for the readiness probe
+        status = 200 if function_startup.is_ready() else 503
+        self.send_body(json.dumps(function_startup.report()).encode("utf-8"), "application/json", status)
+
+    def send_body(self, body, content_type, status=200, headers=None):
+        self.send_response(status)
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_memoized(self, kernel, params=None, paragraphs=None):
+        """Send ``kernel(**params)`` through MEMO, with an ETag and 304 revalidation.
+
+        ``paragraphs`` maps the result to its HTML paragraphs, as for send_result().
+        """
+        bypass = BENCHMARK_MODE or "no-cache" in self.headers.get("Cache-Control", "")
+        # a 304 comes only from a memoized result: revalidating must not
+        # cost the computation it saves the client from downloading
+        tags = [tag.strip() for tag in self.headers.get("If-None-Match", "").split(",") if tag.strip()]
+        if tags and not bypass:
+            # one counted lookup, whether it ends in a 304 or not
+            entry = MEMO.cached(self.function_name, params)
+            if entry is not None and entry[1] in tags:
+                self.send_response(304)
+                self.send_header("ETag", entry[1])
+                self.send_header("Vary", "Accept")
+                self.end_headers()
+                return
+            result, etag = entry if entry is not None else MEMO.compute(self.function_name, kernel, params)
+        else:
+            result, etag = MEMO.call(self.function_name, kernel, params, bypass)
+        self.send_result(result, paragraphs(result) if paragraphs else None, headers={"ETag": etag, "Vary": "Accept"})
+
+    def send_result(self, result, paragraphs=None, status=200, headers=None):
+        """Send a function result as JSON or as the legacy HTML page."""
+        if prefers_json(self.headers.get("Accept", "")):
+            body = json.dumps(result).encode("utf-8")
+            self.send_body(body, "application/json", status, headers)
+        else:
+            if paragraphs is None:
+                paragraphs = ["%s" % (result,)]
+            body = render_html(paragraphs, self.html_title).encode("utf-8")
+            self.send_body(body, "text/html", status, headers)
@@ -0,0 +1,124 @@
+"""Startup phases and readiness of the function servers.
+
+A function server starts in three phases:
+    imports   process start until ``serve()`` is called (interpreter, module
+              imports and module-level setup)
+    preload   ``handler_class.preload()`` in the serving process, before the
+              workers are forked so they share what it loads
+    warm_up   ``handler_class.warm_up()`` in every worker, once it is already
+              listening, with a small invocation of the function
+
+``GET /ready`` answers 503 until every worker has finished its warm-up, then
+200; a worker whose warm-up failed keeps it at 503. The per-worker flags
+live in an anonymous shared mapping allocated before forking, so any worker
+can answer for all of them.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+import mmap
+import os
+import time
+
+# fallback when /proc cannot tell when this process started
+IMPORTED_AT = time.time()
+
+
+def process_start_time():
+    """Wall-clock start of this process, from /proc where available."""
+    try:
+        with open("/proc/self/stat") as f:
+            # the command name may contain spaces, the fields after it do not
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        # starttime counts clock ticks since boot
+        age = time.clock_gettime(time.CLOCK_BOOTTIME) - start_ticks / os.sysconf("SC_CLK_TCK")
+        return time.time() - age
+    except (OSError, ValueError, IndexError, AttributeError):
+        return IMPORTED_AT
+
+
+PROCESS_START = process_start_time()
+PHASES = OrderedDict()  # phase -> seconds
+
+READY_FLAGS = None  # per worker: 0 warming up, 1 ready, 2 warm-up failed
+FAILED = 2
+WORKER = 0
+TIME_TO_READY = None
+
+
+def record(name, seconds):
+    PHASES[name] = seconds
+    print("Startup phase %s: %.3fs" % (name, seconds))
+
+
+@contextmanager
+def phase(name):
+    start = time.perf_counter()
+    yield
+    record(name, time.perf_counter() - start)
+
+
+def imports_done():
+    record("imports", max(0.0, time.time() - PROCESS_START))
+
+
+def setup(workers=1):
+    """Allocate one readiness flag per worker; call before forking."""
+    global READY_FLAGS
+    READY_FLAGS = mmap.mmap(-1, workers)
+
+
+def attach(worker):
+    global WORKER
+    WORKER = worker
+    if READY_FLAGS is not None:
+        READY_FLAGS[worker] = 0
+
+
+def mark_ready():
+    global TIME_TO_READY
+    TIME_TO_READY = time.time() - PROCESS_START
+    if READY_FLAGS is not None:
+        READY_FLAGS[WORKER] = 1
+
+
+def mark_failed():
+    if READY_FLAGS is not None:
+        READY_FLAGS[WORKER] = FAILED
+
+
+def is_ready():
+    if READY_FLAGS is None:
+        # not started through serve(): nothing to wait for
+        return True
+    return all(flag == 1 for flag in READY_FLAGS[:])
+
+
+def failed_workers():
+    if READY_FLAGS is None:
+        return []
+    return [worker for worker, flag in enumerate(READY_FLAGS[:]) if flag == FAILED]
+
+
+def report():
+    return {
+        'ready': is_ready(),
+        'worker': WORKER,
+        'process_start': PROCESS_START,
+        'phases': dict(PHASES),
+        'time_to_ready': TIME_TO_READY,
+        'failed_workers': failed_workers(),
+    }
+
+
+def render_metrics():
+    """The startup timings of this worker in the Prometheus text format."""
+    lines = [
+        "# HELP function_startup_phase_seconds Duration of each startup phase.",
+        "# TYPE function_startup_phase_seconds gauge",
+    ]
+    for name, seconds in PHASES.items():
+        lines.append('function_startup_phase_seconds{phase="%s"} %r' % (name, seconds))
+    lines.append("# HELP function_ready Whether every worker has finished its warm-up.")
+    lines.append("# TYPE function_ready gauge")
+    lines.append("function_ready %d" % is_ready())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,123 @@
+"""All five functions in one server process, routed by path.
+
+    /base64/...     GET /base64/, POST /base64/?op=encode|decode
+    /json/...       POST /json/[?mode=stream|batch]
+    /primes/...     GET /primes/?n=N
+    /sentiment/...  POST /sentiment/[?mode=...], GET /sentiment/cache
+    /compress/...   GET /compress/[?mode=stream], GET /compress/stats
+
+A request is handed to the function's own handler class with the route
+prefix removed, so every function keeps its request/response contract.
+``GET /`` lists the registered functions; /metrics and /ready cover all of
+them.
+
+Configuration (environment variables):
+    HOST_FUNCTIONS    comma-separated functions to serve (default: all)
+    HOST_CONCURRENCY  per-function concurrency limits, e.g. "sentiment=2,primes=8"
+                      (default 4 each)
+"""
+from collections import OrderedDict
+import json
+import os
+
+import function_aio
+import function_registry
+import function_runtime
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# name -> (checkout directory, server script, kernel, handler class)
+SERVERS = OrderedDict([
+    ('base64', ("base64", "web-server-base64.py", "base64py", "FunctionServer")),
+    ('json', ("json", "web-server-json.py", "jsonpy", "FunctionServer")),
+    ('primes', ("primes", "web-server-primes.py", "primespy", "FunctionServer")),
+    ('sentiment', ("sentiment-analysis", "web-server-senti.py", "sentimentpy", "FunctionServer")),
+    ('compress', ("compress", "web-server-compress.py", "generate_lorem_deflate", "AsyncHTTPRequestHandler")),
+])
+
+def server_path(directory, script):
+    # the image copies every script next to this one, a checkout keeps them apart
+    flat = os.path.join(HERE, script)
+    if os.path.exists(flat):
+        return flat
+    return os.path.join(HERE, os.pardir, directory, script)
+
+def register_functions(names, limits):
+    for name in names:
+        directory, script, kernel, handler = SERVERS[name]
+        module = function_registry.load_server(server_path(directory, script))
+        function_registry.register(name, getattr(module, kernel), getattr(module, handler), limits.get(name))
+
+def route_name(target):
+    # "/primes/?n=10" -> "primes"
+    path = target.partition("?")[0]
+    return path[1:].partition("/")[0] if path.startswith("/") else None
+
+class HostHandler(function_runtime.FunctionHandler):
+    function_name = "host"
+
+    @classmethod
+    def metric_functions(cls):
+        return tuple(function_registry.REGISTRY)
+
+    @classmethod
+    def limit_key(cls, head):
+        _, path = function_runtime.request_line(head)
+        name = route_name(path) if path else None
+        return name if name in function_registry.REGISTRY else None
+
+    @classmethod
+    def concurrency_limit(cls, key):
+        return function_registry.REGISTRY[key].concurrency
+
+    @classmethod
+    def preload(cls):
+        for entry in function_registry.REGISTRY.values():
+            entry.handler_class.preload()
+
+    @classmethod
+    def warm_up(cls):
+        for entry in function_registry.REGISTRY.values():
+            entry.handler_class.warm_up()
+
+    def handle(self):
+        # route() turns this handler into the function's handler class, so
+        # every kept-alive request starts out as a host request again
+        host_class = type(self)
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            self.__class__ = host_class
+            self.handle_one_request()
+
+    def route(self):
+        if self.path.partition("?")[0] == "/":
+            listing = [entry.describe() for entry in function_registry.REGISTRY.values()]
+            self.send_body(json.dumps(listing).encode("utf-8"), "application/json")
+            return False
+        entry = function_registry.lookup(route_name(self.path))
+        if entry is None:
+            self.send_error(404, "No function is routed at %s" % self.path.partition("?")[0])
+            return False
+
+        path, sep, query = self.path.partition("?")
+        self.path = "/" + path[1:].partition("/")[2] + sep + query
+        self.__class__ = entry.handler_class
+        return True
+
+def run(server_class=function_aio.AsyncHTTPServer, handler_class=HostHandler):
+    names = [name.strip() for name in os.getenv("HOST_FUNCTIONS", ",".join(SERVERS)).split(",") if name.strip()]
+    unknown = set(names) - set(SERVERS)
+    if unknown:
+        raise ValueError("HOST_FUNCTIONS names unknown functions: %s" % ", ".join(sorted(unknown)))
+    register_functions(names, function_registry.parse_limits(os.getenv("HOST_CONCURRENCY", "")))
+
+    class HostServer(server_class):
+        # one executor thread for every request the limits let run at once
+        executor_threads = sum(entry.concurrency for entry in function_registry.REGISTRY.values())
+
+    server_address = ("0.0.0.0", 8000)
+    function_runtime.serve(handler_class, server_class=HostServer, address=server_address)
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,153 @@
+"""Incremental parser that computes the coordinate centroid while bytes arrive.
+
+``CentroidParser`` is fed the raw request body chunk by chunk. It walks the
+top-level object itself and only hands single array elements (one
+``{"x": .., "y": .., "z": ..}`` at a time) or unrelated top-level values to
+``json.JSONDecoder.raw_decode``. Each coordinate is added to running sums and
+dropped right away, so memory is bounded by the chunk size plus the largest
+single element instead of by the whole payload.
+"""
+import codecs
+import json
+import re
+
+# a single element (or skipped top-level value) may not grow beyond this
+MAX_PENDING = 1 << 20
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+NUMBER_CHARS = frozenset("0123456789+-.eE")
+DECODER = json.JSONDecoder()
+
+# parser states
+START, KEY, COLON, VALUE, NEXT_KEY, ITEM, NEXT_ITEM, DONE = range(8)
+
+
+class CentroidParser:
+    def __init__(self):
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.state = START
+        self.key = None
+        self.found = False
+        self.count = 0
+        self.x = 0
+        self.y = 0
+        self.z = 0
+
+    def feed(self, data, final=False):
+        self.buf += self.utf8.decode(data, final)
+        pos = self.parse(final)
+        self.buf = self.buf[pos:]
+        if len(self.buf) > MAX_PENDING:
+            raise ValueError("JSON element larger than %d bytes" % MAX_PENDING)
+
+    def close(self):
+        self.feed(b"", final=True)
+        if self.state != DONE:
+            raise ValueError("Unexpected end of JSON input")
+        if WHITESPACE.match(self.buf).end() != len(self.buf):
+            raise ValueError("Extra data after JSON object")
+        return self.result()
+
+    def result(self):
+        # same contract as jsonpy()
+        if not self.found or self.count == 0:
+            return {'Error' : 'Input parameters should include coordinates.'}
+        return {'x' : self.x/self.count, 'y' : self.y/self.count, 'z' : self.z/self.count}
+
+    def decode(self, pos, final):
+        """raw_decode one value at ``pos``; None if more input is needed."""
+        buf = self.buf
+        try:
+            value, end = DECODER.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            return None
+        # a number may continue in the next chunk ("12" of "12.5e3")
+        if not final and buf[end - 1] not in '}]"' and (end == len(buf) or buf[end] in NUMBER_CHARS):
+            return None
+        return value, end
+
+    def parse(self, final):
+        buf = self.buf
+        pos = 0
+        while True:
+            pos = WHITESPACE.match(buf, pos).end()
+            if pos == len(buf) or self.state == DONE:
+                return pos
+            c = buf[pos]
+
+            if self.state == START:
+                if c != "{":
+                    raise ValueError("Expected a JSON object at the top level")
+                self.state = KEY
+                pos += 1
+            elif self.state in (KEY, NEXT_KEY):
+                if c == "}" and (self.state == NEXT_KEY or self.key is None):
+                    self.state = DONE
+                    pos += 1
+                elif self.state == NEXT_KEY:
+                    if c != ",":
+                        raise ValueError("Expected ',' or '}' at position %d" % pos)
+                    self.state = KEY
+                    pos += 1
+                else:
+                    decoded = self.decode(pos, final)
+                    if decoded is None:
+                        return pos
+                    self.key, pos = decoded
+                    if not isinstance(self.key, str):
+                        raise ValueError("Expected an object key at position %d" % pos)
+                    self.state = COLON
+            elif self.state == COLON:
+                if c != ":":
+                    raise ValueError("Expected ':' at position %d" % pos)
+                self.state = VALUE
+                pos += 1
+            elif self.state == VALUE:
+                if self.key == "coordinates" and c == "[":
+                    # a repeated key replaces the earlier value, like json.loads
+                    self.found = True
+                    self.count = 0
+                    self.x = self.y = self.z = 0
+                    self.state = ITEM
+                    pos += 1
+                else:
+                    decoded = self.decode(pos, final)
+                    if decoded is None:
+                        return pos
+                    _, pos = decoded
+                    if self.key == "coordinates":
+                        self.found = False
+                    self.state = NEXT_KEY
+            elif self.state == ITEM:
+                if c == "]" and self.count == 0:
+                    self.state = NEXT_KEY
+                    pos += 1
+                    continue
+                decoded = self.decode(pos, final)
+                if decoded is None:
+                    return pos
+                coord, pos = decoded
+                self.x += coord['x']
+                self.y += coord['y']
+                self.z += coord['z']
+                self.count += 1
+                self.state = NEXT_ITEM
+            elif self.state == NEXT_ITEM:
+                if c == "]":
+                    self.state = NEXT_KEY
+                elif c == ",":
+                    self.state = ITEM
+                else:
+                    raise ValueError("Expected ',' or ']' at position %d" % pos)
+                pos += 1
+
+
+def centroid_from_chunks(chunks):
+    """Return the jsonpy() result for a body given as an iterable of chunks."""
+    parser = CentroidParser()
+    for chunk in chunks:
+        parser.feed(chunk)
+    return parser.close()
@@ -1,5 +1,9 @@
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
 import json
+import centroid_stream
+
+import function_aio
+import function_runtime
 
 def jsonpy(params):
     try:
@@ -17,35 +21,96 @@ def jsonpy(params):
 
     return {'x' : x/length, 'y' : y/length, 'z' : z/length}
 
-class FunctionServer(BaseHTTPRequestHandler):
+def jsonpy_batch(documents):
+    # centroids for a list of jsonpy() inputs (bytes or str), in input order;
+    # one jsonpy() per document, which measured faster than gathering the
+    # batch into one NumPy reduction
+    results = []
+    for document in documents:
+        try:
+            params = json.loads(document)
+        except ValueError:
+            results.append({'Error' : 'Input should be a JSON object.'})
+            continue
+        try:
+            results.append(jsonpy(params))
+        except (KeyError, TypeError, ZeroDivisionError):
+            results.append({'Error' : 'Coordinates should be a non-empty list of x, y, z objects.'})
+    return results
+
+STREAM_CHUNK_SIZE = 64 * 1024
+# lines per batch in batch mode
+BATCH_LINES = 4096
+
+class FunctionServer(function_runtime.FunctionHandler):
+    function_name = "json"
+
+    @classmethod
+    def warm_up(cls):
+        document = json.dumps({'coordinates' : [{'x' : 1.0, 'y' : 2.0, 'z' : 3.0}]})
+        jsonpy(json.loads(document))
+        jsonpy_batch([document, document])
+        centroid_stream.centroid_from_chunks([document.encode("utf-8")])
+
     def do_POST(self):
         # inherited from BaseHTTPRequestHandler
         content_length = int(self.headers['Content-Length'])
-        data = json.loads(self.rfile.read(content_length))
+        mode = parse_qs(urlparse(self.path).query).get('mode', [None])[0]
+
+        if mode == 'batch':
+            self.do_batch(content_length)
+            return
+        if mode == 'stream':
+            # parse the body while it arrives instead of loading it whole
+            chunks = function_runtime.read_body(self.rfile, content_length, bytearray(STREAM_CHUNK_SIZE))
+            try:
+                results = centroid_stream.centroid_from_chunks(chunks)
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_error(400, "Invalid input: %r" % e)
+                return
+        else:
+            data = json.loads(self.rfile.read(content_length))
 
-        # execute the function
-        results = jsonpy(data)
+            # execute the function
+            results = jsonpy(data)
 
+        self.send_result(results)
+
+    def do_batch(self, content_length):
+        # NDJSON in, NDJSON out: one {"coordinates": [...]} per line, one result per line
         self.send_response(200)
-        self.send_header("Content-type", "text/html")
+        self.send_header("Content-type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
         self.end_headers()
-        self.wfile.write(bytes("<html>\n<head><title>Function Execution Results</title></head>\n", "utf-8"))
-        self.wfile.write(bytes("<body>\n", "utf-8"))
-        self.wfile.write(bytes("<p>%s</p>\n" % results, "utf-8"))
-        self.wfile.write(bytes("</body>\n</html>", "utf-8"))
 
-def run(server_class=HTTPServer, handler_class=FunctionServer):
-    server_address = ("0.0.0.0", 8000)
-    httpd = server_class(server_address, handler_class)
-    print("Launching server...")
+        out = function_runtime.ChunkedWriter(self.wfile)
+        batch = []
+        for line in self.read_lines(content_length):
+            if line.strip():
+                batch.append(line)
+            if len(batch) == BATCH_LINES:
+                out.write(self.ndjson(jsonpy_batch(batch)))
+                batch = []
+        if batch:
+            out.write(self.ndjson(jsonpy_batch(batch)))
+        out.close()
 
-    try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        pass
+    def read_lines(self, length):
+        remaining = length
+        while remaining > 0:
+            line = self.rfile.readline(remaining)
+            if not line:
+                break
+            remaining -= len(line)
+            yield line
 
-    httpd.server_close()
-    print("\nServer stopped.")
+    @staticmethod
+    def ndjson(results):
+        return "".join(json.dumps(result) + "\n" for result in results).encode("utf-8")
+
+def run(server_class=function_aio.AsyncHTTPServer, handler_class=FunctionServer):
+    server_address = ("0.0.0.0", 8000)
+    function_runtime.serve(handler_class, server_class=server_class, address=server_address)
 
 if __name__ == "__main__":
     run()
@@ -0,0 +1,199 @@
+"""Seeded synthetic request bodies for the json and sentiment functions.
+
+A payload is described by its function, target size in bytes and seed; the
+same description always gives the same bytes. Bodies are serialized once
+and reused: small ones are kept as ``bytes``, and bodies of MMAP_THRESHOLD
+or more are written once to a file in the cache directory and memory-mapped,
+so a 500 MB payload costs neither the time to rebuild it nor 500 MB of
+private memory per load generator.
+
+    json       {"coordinates": [{"x": .., "y": .., "z": .., "name": .., "opts": ..}, ...]}
+               in the shape of json/json-data.json
+    sentiment  {"analyse": "..."}: sentences over a small vocabulary of
+               positive, negative and neutral words
+
+A body ends at the last element that fits, so it is at most ``size`` bytes
+and shorter by less than one element (about 120 bytes). The smallest body is
+the empty document, {"coordinates": []} or {"analyse": ""}; a smaller size
+is a ValueError.
+
+    python payloads.py json 64MB --seed 1 --output coords.json
+"""
+import argparse
+import mmap
+import os
+import random
+import re
+import sys
+import tempfile
+
+MMAP_THRESHOLD = 16 * 1024 * 1024
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "faas-payloads")
+# generators write in pieces of about this size
+PIECE_SIZE = 256 * 1024
+
+NAME_SYLLABLES = ("oy", "uw", "ek", "ba", "zi", "lo", "ne", "ta", "ru", "mi")
+POSITIVE = ("good", "great", "happy", "excellent", "wonderful", "free", "fair", "beautiful", "best", "safe")
+NEGATIVE = ("bad", "terrible", "sad", "poor", "awful", "cruel", "unjust", "worst", "dangerous", "weak")
+NEUTRAL = ("people", "government", "the", "a", "of", "and", "to", "law", "rights", "nation", "time",
+           "that", "their", "is", "are", "with", "for", "power", "history", "world", "we", "they")
+WORDS = POSITIVE + NEGATIVE + NEUTRAL * 3
+
+
+def parse_size(text):
+    """"1KB", "64MiB", "2g" or "1000" -> bytes (K, M and G are powers of 1024)."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?\s*", str(text), re.IGNORECASE)
+    if not match:
+        raise ValueError("size should look like 1000, 1KB, 64MB or 2GB, got %r" % text)
+    number, unit = match.groups()
+    return int(float(number) * 1024 ** " kmg".index(unit.lower() or " "))
+
+
+# the head and tail around the elements of each body
+ENVELOPES = {
+    'json': (b'{"coordinates": [', b"]}"),
+    'sentiment': (b'{"analyse": "', b'"}'),
+}
+
+
+def check_size(function, size):
+    head, tail = ENVELOPES[function]
+    if size < len(head) + len(tail):
+        raise ValueError("a %s payload is at least %d bytes, got %d" % (function, len(head) + len(tail), size))
+
+
+def coordinate_pieces(size, seed):
+    check_size('json', size)
+    rng = random.Random(seed)
+    head, tail = ENVELOPES['json']
+    yield head
+    written = len(head) + len(tail)
+    parts = []
+    parts_size = 0
+    separator = ""
+    while True:
+        name = "".join(rng.choice(NAME_SYLLABLES) for _ in range(3))
+        element = '%s{"x": %r, "y": %r, "z": %r, "name": "%s %d", "opts": {"1": [1, true]}}' % (
+            separator, rng.random(), rng.random(), rng.random(), name, rng.randrange(10000))
+        if written + len(element) > size:
+            break
+        separator = ", "
+        parts.append(element)
+        parts_size += len(element)
+        written += len(element)
+        if parts_size >= PIECE_SIZE:
+            yield "".join(parts).encode("ascii")
+            parts = []
+            parts_size = 0
+    yield "".join(parts).encode("ascii")
+    yield tail
+
+
+def sentiment_pieces(size, seed):
+    check_size('sentiment', size)
+    rng = random.Random(seed)
+    head, tail = ENVELOPES['sentiment']
+    yield head
+    written = len(head) + len(tail)
+    parts = []
+    parts_size = 0
+    separator = ""
+    while True:
+        words = [rng.choice(WORDS) for _ in range(rng.randint(6, 24))]
+        sentence = "%s%s %s%s" % (separator, words[0].capitalize(), " ".join(words[1:]), rng.choice(".!?"))
+        if written + len(sentence) > size:
+            break
+        separator = " "
+        parts.append(sentence)
+        parts_size += len(sentence)
+        written += len(sentence)
+        if parts_size >= PIECE_SIZE:
+            yield "".join(parts).encode("ascii")
+            parts = []
+            parts_size = 0
+    yield "".join(parts).encode("ascii")
+    yield tail
+
+
+GENERATORS = {
+    'json': coordinate_pieces,
+    'sentiment': sentiment_pieces,
+}
+
+
+def build(function, size, seed=0):
+    """The payload as bytes."""
+    return b"".join(GENERATORS[function](size, seed))
+
+
+def write(function, size, seed, path):
+    """Write the payload to ``path``; returns its length."""
+    check_size(function, size)
+    length = 0
+    with open(path, "wb") as f:
+        for piece in GENERATORS[function](size, seed):
+            f.write(piece)
+            length += len(piece)
+    return length
+
+
+def cache_path(function, size, seed, directory=None):
+    return os.path.join(directory or CACHE_DIR, "%s-%d-%d.json" % (function, size, seed))
+
+
+def map_file(path):
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+PAYLOADS = {}  # (function, size, seed) -> bytes or read-only mmap
+
+
+def payload(function, size, seed=0, directory=None):
+    """The payload as bytes, or as a read-only mmap when it is large.
+
+    Built on first use and shared by every later call in this process; large
+    payloads are also kept on disk for the next process.
+    """
+    if function not in GENERATORS:
+        raise ValueError("no payload generator for %r, only %s" % (function, ", ".join(GENERATORS)))
+    check_size(function, size)
+    key = (function, size, seed)
+    if key not in PAYLOADS:
+        if size < MMAP_THRESHOLD:
+            PAYLOADS[key] = build(function, size, seed)
+        else:
+            path = cache_path(function, size, seed, directory)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # written under a temporary name so a crash leaves no truncated body behind
+                partial = "%s.%d.partial" % (path, os.getpid())
+                write(function, size, seed, partial)
+                os.replace(partial, path)
+            PAYLOADS[key] = map_file(path)
+    return PAYLOADS[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic request body.")
+    parser.add_argument("function", choices=list(GENERATORS))
+    parser.add_argument("size", help="target size, e.g. 1KB, 64MB")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write (default: stdout)")
+    args = parser.parse_args()
+    try:
+        size = parse_size(args.size)
+        check_size(args.function, size)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.output:
+        length = write(args.function, size, args.seed, args.output)
+        print("wrote %d bytes to %s" % (length, args.output), file=sys.stderr)
+    else:
+        for piece in GENERATORS[args.function](size, args.seed):
+            sys.stdout.buffer.write(piece)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Process-wide prime table that answers prime counts by binary search.
+
+The table holds every prime up to ``bound`` as a sorted uint32 array, so
+pi(n) for n <= bound is ``bisect_right(primes, n)``. A request above the
+bound grows the table with the segmented sieve, starting where the table
+ends and at least doubling it, so repeated requests never re-sieve. The
+table stops growing at ``max_n``; larger n are answered as the table count
+plus a streaming count of the remainder.
+
+With a ``path`` the table is memory-mapped from disk, so pre-forked workers
+and restarted containers share one copy through the page cache, and every
+extension is written back atomically.
+"""
+from array import array
+from bisect import bisect_right
+from itertools import compress
+import math
+import mmap
+import os
+import struct
+import threading
+
+import sieve
+
+TABLE_MAX_N = int(os.getenv("PRIMES_TABLE_MAX_N", 10 ** 8))
+
+# file layout: header, then the primes as native-endian uint32
+HEADER = struct.Struct("<8sQQ")  # magic, bound, number of primes
+MAGIC = b"PRIMETB1"
+TYPECODE = "I"
+assert array(TYPECODE).itemsize == 4
+
+
+class PrimeTable:
+    def __init__(self, path=None, max_n=TABLE_MAX_N):
+        self.path = path
+        self.max_n = min(max_n, 2 ** 32 - 1)
+        self.lock = threading.Lock()
+        # (bound, primes) is swapped as one tuple so readers never see a
+        # bound that does not match the primes array
+        self.state = (2, array(TYPECODE, [2]))
+        if path:
+            self.load(path)
+
+    @property
+    def bound(self):
+        return self.state[0]
+
+    def load(self, path):
+        """Map the table stored at ``path`` if it covers more than ours."""
+        try:
+            with open(path, "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return False
+        try:
+            magic, bound, count = HEADER.unpack_from(mm)
+        except struct.error:
+            magic, bound, count = None, 0, 0
+        if magic != MAGIC or len(mm) != HEADER.size + 4 * count:
+            print("Ignoring invalid prime table file %s" % path)
+            mm.close()
+            return False
+        if bound <= self.bound:
+            mm.close()
+            return False
+        self.state = (bound, memoryview(mm)[HEADER.size:].cast(TYPECODE))
+        return True
+
+    def save(self, path):
+        bound, primes = self.state
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, bound, len(primes)))
+            f.write(primes)
+        os.replace(tmp, path)
+
+    def extend(self, n):
+        """Make sure the table covers min(n, max_n)."""
+        n = min(n, self.max_n)
+        if n <= self.bound:
+            return
+        with self.lock:
+            # another worker may already have written a larger table
+            if self.path and self.load(self.path) and n <= self.bound:
+                return
+            bound, primes = self.state
+            if n <= bound:
+                return
+            target = min(max(n, 2 * bound), self.max_n)
+            root = math.isqrt(target)
+            base = primes[1:bisect_right(primes, root)] if root <= bound else None
+
+            grown = array(TYPECODE)
+            grown.frombytes(memoryview(primes).cast("B"))
+            for start, segment, size in sieve.segments(bound + 1, target, primes=base):
+                grown.extend(compress(range(start, start + 2 * size, 2), segment[:size]))
+            self.state = (target, grown)
+
+            if self.path:
+                try:
+                    self.save(self.path)
+                except OSError as e:
+                    print("Could not save prime table to %s: %s" % (self.path, e))
+
+    def count(self, n):
+        """Return the number of primes <= n."""
+        if n < 2:
+            return 0
+        if n > self.bound:
+            self.extend(n)
+        bound, primes = self.state
+        if n <= bound:
+            return bisect_right(primes, n)
+        return len(primes) + sieve.count_range(bound + 1, n)
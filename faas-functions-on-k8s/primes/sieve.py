@@ -0,0 +1,79 @@
+"""Segmented sieve of Eratosthenes for counting primes up to n.
+
+Only odd numbers are stored, one byte each, in a bytearray segment of
+SEGMENT_SIZE bytes that is reused for the whole sweep. Crossing off is done
+with C-level slice assignment and counting with ``bytearray.count``, so no
+Python list of candidates or primes is ever built. Memory is bounded by the
+segment plus the base primes up to sqrt(n), independent of n itself.
+"""
+import math
+import os
+
+SEGMENT_SIZE = 1 << 18   # bytes (odd numbers) per segment, sized to stay in L2
+MAX_N = int(os.getenv("PRIMES_MAX_N", 10 ** 9))
+
+
+def base_primes(limit):
+    """Return the odd primes <= limit with a plain odd-only sieve."""
+    if limit < 3:
+        return []
+    # index i represents 2 * i + 3
+    size = (limit - 3) // 2 + 1
+    s = bytearray(b"\x01") * size
+    for i in range((math.isqrt(limit) - 3) // 2 + 1):
+        if s[i]:
+            p = 2 * i + 3
+            j = (p * p - 3) // 2
+            s[j::p] = bytes(len(range(j, size, p)))
+    return [2 * i + 3 for i in range(size) if s[i]]
+
+
+def segments(lo, hi, segment_size=SEGMENT_SIZE, primes=None):
+    """Sieve the odd numbers in [lo, hi] one segment at a time.
+
+    Yields ``(start, segment, size)`` where ``segment[i]`` is 1 iff
+    ``start + 2 * i`` is prime for ``i < size``. The same bytearray is reused
+    for every segment, so consume it before advancing. ``primes`` may supply
+    the odd base primes (at least up to sqrt(hi)) to skip recomputing them.
+    """
+    lo = max(lo, 3) | 1
+    if lo > hi:
+        return
+    if primes is None:
+        primes = base_primes(math.isqrt(hi))
+    zeros = memoryview(bytes(segment_size))
+    ones = memoryview(b"\x01" * segment_size)
+    segment = bytearray(segment_size)
+
+    # index i of a segment starting at odd number lo represents lo + 2 * i
+    while lo <= hi:
+        size = min(segment_size, (hi - lo) // 2 + 1)
+        segment[:size] = ones[:size]
+        end = lo + 2 * size  # exclusive
+        for p in primes:
+            start = p * p
+            if start >= end:
+                break
+            if start < lo:
+                # first odd multiple of p that is >= lo
+                start = -(-lo // p) * p
+                if start % 2 == 0:
+                    start += p
+            i = (start - lo) // 2
+            if i < size:
+                segment[i:size:p] = zeros[:len(range(i, size, p))]
+        yield lo, segment, size
+        lo = end
+
+
+def count_range(lo, hi, segment_size=SEGMENT_SIZE):
+    """Count the primes p with lo <= p <= hi."""
+    count = 1 if lo <= 2 <= hi else 0
+    for _, segment, size in segments(lo, hi, segment_size):
+        count += segment.count(1, 0, size)
+    return count
+
+
+def count_primes(n, segment_size=SEGMENT_SIZE):
+    """Count the primes <= n."""
+    return count_range(2, n, segment_size)
@@ -1,61 +1,60 @@
-from http.server import HTTPServer, BaseHTTPRequestHandler
-import sys
-
-def primespy():
-    n = 10000000
-
-    if n < 2:
-        return {'Number of primes found': 0}
-    if n == 2:
-        return {'Number of primes found': 2}
-    # do only odd numbers starting at 3
-    if sys.version_info.major <= 2:
-        s = range(3, n + 1, 2)
-    else:  # Python 3
-        s = list(range(3, n + 1, 2))
-    # n**0.5 simpler than math.sqr(n)
-    mroot = n ** 0.5
-    half = len(s)
-    i = 0
-    m = 3
-    while m <= mroot:
-        if s[i]:
-            j = (m * m - 3) // 2  # int div
-            s[j] = 0
-            while j < half:
-                s[j] = 0
-                j += m
-        i = i + 1
-        m = 2 * i + 3
-    res = [2] + [x for x in s if x]
-    return {'Number of primes found': len(res)}
-
-class FunctionServer(BaseHTTPRequestHandler):
-    def do_GET(self):
-        # inherited from BaseHTTPRequestHandler 
-        # execute the function
-        result = primespy()
-
-        self.send_response(200)
-        self.send_header("Content-type", "text/html")
-        self.end_headers()
-        self.wfile.write(bytes("<html>\n<head><title>Function Execution Results</title></head>\n", "utf-8"))
-        self.wfile.write(bytes("<body>\n", "utf-8"))
-        self.wfile.write(bytes("<p>%s</p>\n" % result, "utf-8"))
-        self.wfile.write(bytes("</body>\n</html>", "utf-8"))
-
-def run(server_class=HTTPServer, handler_class=FunctionServer):
-    server_address = ("0.0.0.0", 8000)
-    httpd = server_class(server_address, handler_class)
-    print("Launching server...")
+from urllib.parse import urlparse, parse_qs
+import os
+import prime_table
+import sieve
+
+import function_aio
+import function_runtime
+
+DEFAULT_N = 10000000
+# the table is built up to this before the workers fork (0 skips it)
+WARMUP_N = int(os.getenv("PRIMES_WARMUP_N", DEFAULT_N))
 
+# shared by every request in this process; PRIMES_TABLE_PATH keeps it on disk
+TABLE = prime_table.PrimeTable(path=os.getenv("PRIMES_TABLE_PATH"))
+
+def primespy(n=DEFAULT_N):
     try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        pass
+        n = int(n)
+    except (TypeError, ValueError):
+        return {'Error' : 'Parameter n should be an integer.'}
+    if n > sieve.MAX_N:
+        return {'Error' : 'Parameter n should not exceed %d.' % sieve.MAX_N}
+
+    return {'Number of primes found': TABLE.count(n)}
+
+class FunctionServer(function_runtime.FunctionHandler):
+    function_name = "primes"
+
+    @classmethod
+    def preload(cls):
+        # precompute before forking so the workers share the table pages
+        print("Warming up prime table to n=%d..." % WARMUP_N)
+        TABLE.extend(WARMUP_N)
+
+    @classmethod
+    def warm_up(cls):
+        # a lookup in the preloaded table: a larger n would grow it in each
+        # worker's private pages
+        if WARMUP_N:
+            primespy(WARMUP_N)
 
-    httpd.server_close()
-    print("\nServer stopped.")
+    def do_GET(self):
+        # inherited from BaseHTTPRequestHandler 
+        # execute the function, n defaults to the historical 10,000,000
+        query = parse_qs(urlparse(self.path).query)
+        n = query.get('n', [DEFAULT_N])[0]
+        try:
+            # memoized by the normalized n, so "10" and "010" share an entry
+            n = int(n)
+        except (TypeError, ValueError):
+            self.send_result(primespy(n))
+            return
+        self.send_memoized(primespy, {'n': n})
+
+def run(server_class=function_aio.AsyncHTTPServer, handler_class=FunctionServer):
+    server_address = ("0.0.0.0", 8000)
+    function_runtime.serve(handler_class, server_class=server_class, address=server_address)
 
 if __name__ == "__main__":
     run()
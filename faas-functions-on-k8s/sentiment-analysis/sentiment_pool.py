@@ -0,0 +1,89 @@
+"""Persistent process pool that scores sentences of large documents in parallel.
+
+Sentence splitting stays in the server process; the pool only receives the
+sentence texts in batches and returns ``(subjectivity, polarity)`` for each,
+in order. Every pool process builds the TextBlob sentiment analyzer and
+loads its lexicon once, in the pool initializer, so requests never pay for
+it. The pool is created lazily in the process that uses it, which keeps it
+out of the parent when the serving runtime pre-forks workers.
+
+Configuration (environment variables):
+    SENTIMENT_POOL_WORKERS  pool processes per server worker (default: the
+                            available CPUs divided among the server workers,
+                            at least 1)
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import math
+import os
+import threading
+
+import function_runtime
+
+# every pre-forked server worker has its own pool: together they get one
+# process per CPU, not one per CPU each
+POOL_WORKERS = int(os.getenv("SENTIMENT_POOL_WORKERS", 0)) or \
+    max(1, function_runtime.worker_count("auto") // function_runtime.worker_count())
+# smallest batch worth the pickling round trip
+MIN_BATCH = 8
+
+analyzer = None
+pool = None
+pool_pid = None
+pool_lock = threading.Lock()
+
+
+def init_worker():
+    global analyzer
+    from textblob.en.sentiments import PatternAnalyzer
+    analyzer = PatternAnalyzer()
+    # the lexicon is loaded on the first analysis
+    analyzer.analyze("warm up")
+
+
+def score_batch(texts):
+    results = []
+    for text in texts:
+        sentiment = analyzer.analyze(text)
+        results.append((sentiment.subjectivity, sentiment.polarity))
+    return results
+
+
+def get_pool():
+    global pool, pool_pid
+    with pool_lock:
+        if pool is None or pool_pid != os.getpid():
+            pool = ProcessPoolExecutor(max_workers=POOL_WORKERS, initializer=init_worker)
+            pool_pid = os.getpid()
+        return pool
+
+
+def reset_pool():
+    global pool
+    with pool_lock:
+        if pool is not None and pool_pid == os.getpid():
+            pool.shutdown(wait=False)
+        pool = None
+
+
+def warm_up():
+    """Start every pool process and load the analyzer in each."""
+    executor = get_pool()
+    list(executor.map(score_batch, [["warm up"]] * POOL_WORKERS))
+
+
+def score_texts(texts):
+    """Return ``(subjectivity, polarity)`` for each text, scored in the pool."""
+    if not texts:
+        return []
+    # a few batches per process so a slow batch does not leave cores idle
+    size = max(MIN_BATCH, math.ceil(len(texts) / (POOL_WORKERS * 4)))
+    batches = [texts[i:i + size] for i in range(0, len(texts), size)]
+    try:
+        results = []
+        for scores in get_pool().map(score_batch, batches):
+            results += scores
+        return results
+    except BrokenProcessPool:
+        reset_pool()
+        raise
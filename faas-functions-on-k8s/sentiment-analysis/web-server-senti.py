@@ -1,52 +1,122 @@
-from http.server import HTTPServer, BaseHTTPRequestHandler
 from textblob import TextBlob
+from urllib.parse import urlparse, parse_qs
 import json
+import os
+import sentiment_pool
 
-def sentimentpy(params):
+import function_aio
+import function_cache
+import function_runtime
+
+# (subjectivity, polarity) per normalized sentence, shared by all requests of this worker
+SENTENCE_CACHE = function_cache.LRUCache(max_bytes=int(os.getenv("SENTIMENT_CACHE_BYTES", 16 * 1024 * 1024)))
+
+# documents with at least this many sentences are scored in the process pool
+PARALLEL_MIN_SENTENCES = int(os.getenv("SENTIMENT_PARALLEL_MIN_SENTENCES", 200))
+
+# start the pool processes during warm-up instead of on the first large document
+POOL_WARMUP = os.getenv("SENTIMENT_POOL_WARMUP", "1") != "0"
+
+WARM_UP_TEXT = "Warm up the sentence tokenizer. The sentiment lexicon is loaded on first use!"
+
+def normalize_sentence(text):
+    # the analyzer splits on whitespace, so runs of it do not change the score;
+    # case does (":D" is an emoticon, ":d" is not), so it is kept
+    return " ".join(text.split())
+
+def score_sentences(sentences, parallel=False):
+    # (subjectivity, polarity) for each sentence, from the cache where possible
+    keys = [normalize_sentence(sentence.raw) for sentence in sentences]
+    scores = [SENTENCE_CACHE.get(key) for key in keys]
+    misses = {}
+    for sentence, key, score in zip(sentences, keys, scores):
+        if score is None and key not in misses:
+            misses[key] = sentence
+
+    if parallel and len(misses) >= sentiment_pool.MIN_BATCH:
+        try:
+            computed = dict(zip(misses, sentiment_pool.score_texts([sentence.raw for sentence in misses.values()])))
+        except sentiment_pool.BrokenProcessPool:
+            print("Sentiment pool broke, scoring this request in-process.")
+            computed = None
+    else:
+        computed = None
+    if computed is None:
+        computed = {}
+        for key, sentence in misses.items():
+            sentiment = sentence.sentiment
+            computed[key] = (sentiment.subjectivity, sentiment.polarity)
+
+    for key, score in computed.items():
+        SENTENCE_CACHE.put(key, score)
+    return [score if score is not None else computed[key] for key, score in zip(keys, scores)]
+
+def sentimentpy(params, parallel=None):
     try:
         analyse = TextBlob(params['analyse'])
     except:
         return {'Error' : 'Input parameters should include a string to sentiment analyse.'}
 
     sentences = len(analyse.sentences)
+    if parallel is None:
+        # large documents go to the process pool
+        parallel = sentences >= PARALLEL_MIN_SENTENCES
+
+    # one analysis per sentence, both scores at once
+    subjectivity = 0
+    polarity = 0
+    for sentence_subjectivity, sentence_polarity in score_sentences(analyse.sentences, parallel):
+        subjectivity += sentence_subjectivity
+        polarity += sentence_polarity
 
     retVal = {}
 
-    retVal["subjectivity"] = sum([sentence.sentiment.subjectivity for sentence in analyse.sentences]) / sentences
-    retVal["polarity"] = sum([sentence.sentiment.polarity for sentence in analyse.sentences]) / sentences
+    retVal["subjectivity"] = subjectivity / sentences
+    retVal["polarity"] = polarity / sentences
     retVal["sentences"] = sentences
 
     return retVal
 
-class FunctionServer(BaseHTTPRequestHandler):
+class FunctionServer(function_runtime.FunctionHandler):
+    function_name = "sentiment"
+
+    @classmethod
+    def preload(cls):
+        # NLTK's tokenizer and the pattern lexicon load lazily on first use;
+        # load them before forking so the workers share them
+        for sentence in TextBlob(WARM_UP_TEXT).sentences:
+            sentence.sentiment
+
+    @classmethod
+    def warm_up(cls):
+        sentimentpy({'analyse' : WARM_UP_TEXT}, parallel=False)
+        # the warm-up sentences are not traffic: leave no entries or counters behind
+        SENTENCE_CACHE.clear()
+        SENTENCE_CACHE.reset_stats()
+        if POOL_WARMUP:
+            sentiment_pool.warm_up()
+
+    def do_GET(self):
+        # GET /cache reports the sentence cache counters
+        if self.path.split('?')[0] != '/cache':
+            self.send_error(404)
+            return
+        self.send_body(json.dumps(SENTENCE_CACHE.stats()).encode("utf-8"), "application/json")
+
     def do_POST(self):
         # inherited from BaseHTTPRequestHandler 
         content_length = int(self.headers['Content-Length'])
         data = json.loads(self.rfile.read(content_length))
 
-        # execute the function
-        result = sentimentpy(data)
+        # execute the function; ?mode=parallel or ?mode=serial overrides the size threshold
+        mode = parse_qs(urlparse(self.path).query).get('mode', [None])[0]
+        result = sentimentpy(data, parallel={'parallel': True, 'serial': False}.get(mode))
 
-        self.send_response(200)
-        self.send_header("Content-type", "text/html")
-        self.end_headers()
-        self.wfile.write(bytes("<html>\n<head><title>Function Execution Results</title></head>\n", "utf-8"))
-        self.wfile.write(bytes("<body>\n", "utf-8"))
-        self.wfile.write(bytes("<p>%s</p>\n" % result, "utf-8"))
-        self.wfile.write(bytes("</body>\n</html>", "utf-8"))
+        self.send_result(result)
 
-def run(server_class=HTTPServer, handler_class=FunctionServer):
+def run(server_class=function_aio.AsyncHTTPServer, handler_class=FunctionServer):
     server_address = ("0.0.0.0", 8000)
-    httpd = server_class(server_address, handler_class)
-    print("Launching server...")
-
-    try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        pass
-
-    httpd.server_close()
-    print("\nServer stopped.")
+    function_runtime.serve(handler_class, server_class=server_class, address=server_address)
 
 if __name__ == "__main__":
     run()
@@ -110,14 +110,12 @@ class PCAPEnvironment:
         print('target_containers:', target_containers)
 
         # get system metrics for target containers
-        traces = {}
+        traces = TraceStore()
         namespace_query = "namespace=\'" + self.app_namespace + "\'"
-        container_queries = []
         self.prom_client.update_period(FORECASTING_SIGHT_SEC)
         self.user_space_prom_client.update_period(FORECASTING_SIGHT_SEC)
-        for container in target_containers:
-            container_query = "container='" + container + "'"
-            container_queries.append(container_query)
+        # one selector for all target containers; get_promdata splits the series by container
+        container_query = 'container=~"' + label_regex(target_containers) + '"'
 
         for resource in self.controlled_resources:
             if resource.lower() == "cpu":
@@ -132,21 +130,22 @@ class PCAPEnvironment:
                 resource_query = "rate(container_network_transmit_bytes_total{%s}[1m])"
 
             # retrieve the metrics for target containers in all pods
-            for container_query in container_queries:
+            if target_containers:
                 query_index = namespace_query + "," + container_query
                 query = resource_query % (query_index)
                 print(query)
 
-                # retrieve the metrics for the target container from Prometheus
+                # retrieve the metrics for the target containers from Prometheus
                 traces = self.prom_client.get_promdata(query, traces, resource)
 
-        # custom metrics exported to prometheus
-        for metric in self.custom_metrics:
-            metric_query = metric.lower()
+        # custom metrics exported to prometheus, in one query; each series is
+        # filed under its metric name
+        if self.custom_metrics:
+            metric_query = '{__name__=~"' + label_regex([metric.lower() for metric in self.custom_metrics]) + '"}'
             print(metric_query)
 
             # retrieve the metrics from Prometheus
-            traces = self.user_space_prom_client.get_promdata(metric_query, traces, metric)
+            traces = self.user_space_prom_client.get_promdata(metric_query, traces, None, resource_label='__name__')
 
         # print('Collected Traces:', traces)
         print('Collected traces for', self.app_name)
@@ -161,47 +160,37 @@ class PCAPEnvironment:
             all_values = []
             # print('cpu_traces:', cpu_traces)
             for container in cpu_traces:
-                cpu_utils = []
-                for measurement in cpu_traces[container]:
-                    cpu_utils.append(float(measurement[1]))
-                print('Avg CPU Util ('+container+'):', np.mean(cpu_utils))
-                all_values.append(np.mean(cpu_utils))
+                cpu_util = cpu_traces[container].mean()
+                print('Avg CPU Util ('+container+'):', cpu_util)
+                all_values.append(cpu_util)
             self.states['cpu_util'] = np.mean(all_values)
         if 'memory' in self.controlled_resources:
             all_values = []
             for container in memory_traces:
-                memory_usages = []
-                for measurement in memory_traces[container]:
-                    memory_usages.append(int(measurement[1]) / 1024 / 1024.0)
-                print('Avg Memory Usage ('+container+'):', np.mean(memory_usages), 'MiB', '| Limit:', self.states['memory_limit'], 'MiB')
-                all_values.append(np.mean(memory_usages))
+                memory_usage = memory_traces[container].mean() / 1024 / 1024.0
+                print('Avg Memory Usage ('+container+'):', memory_usage, 'MiB', '| Limit:', self.states['memory_limit'], 'MiB')
+                all_values.append(memory_usage)
             self.states['memory_util'] = np.mean(all_values) # / self.states['memory_limit']
         if 'blkio' in self.controlled_resources:
             all_values = []
             for container in blkio_traces:
-                blkio_usages = []
-                for measurement in blkio_traces[container]:
-                    blkio_usages.append(int(measurement[1]) / 1024 / 1024.0)
-                print('Avg Disk I/O Usage ('+container+'):', np.mean(blkio_usages), 'MiB')
-                all_values.append(np.mean(blkio_usages))
+                blkio_usage = blkio_traces[container].mean() / 1024 / 1024.0
+                print('Avg Disk I/O Usage ('+container+'):', blkio_usage, 'MiB')
+                all_values.append(blkio_usage)
             self.states['disk_io_usage'] = np.mean(all_values)
         if 'ingress' in self.controlled_resources:
             all_values = []
             for container in ingress_traces:
-                ingress = []
-                for measurement in ingress_traces[container]:
-                    ingress.append(int(measurement[1]) / 1024.0)
-                print('Avg Ingress ('+container+'):', np.mean(ingress), 'KiB/s')
-                all_values.append(np.mean(ingress))
+                ingress = ingress_traces[container].mean() / 1024.0
+                print('Avg Ingress ('+container+'):', ingress, 'KiB/s')
+                all_values.append(ingress)
             self.states['ingress_rate'] = np.mean(all_values)
         if 'egress' in self.controlled_resources:
             all_values = []
             for container in egress_traces:
-                egress = []
-                for measurement in egress_traces[container]:
-                    egress.append(int(measurement[1]) / 1024.0)
-                print('Avg egress ('+container+'):', np.mean(egress), 'KiB/s')
-                all_values.append(np.mean(egress))
+                egress = egress_traces[container].mean() / 1024.0
+                print('Avg egress ('+container+'):', egress, 'KiB/s')
+                all_values.append(egress)
             self.states['egress_rate'] = np.mean(all_values)
 
         # get the custom metrics (PCAP-related)
@@ -214,10 +203,7 @@ class PCAPEnvironment:
                 metric_traces = traces['pcap-scheduler']['event_pcap_file_discovery_rate']
                 rate = []
                 for trace in metric_traces:
-                    values = []
-                    for measurement in metric_traces[trace]:
-                        values.append(float(measurement[1]))
-                    rate.append(np.mean(values))
+                    rate.append(metric_traces[trace].mean())
                 print('Avg PCAP file discovery rate:', np.mean(rate))
                 print('Total PCAP file discovery rate:', sum(rate))
                 self.states['pcap_file_discovery_rate'] = np.mean(rate)
@@ -230,11 +216,9 @@ class PCAPEnvironment:
                 metric_traces = traces['pcap-log-monitor']['event_pcap_rate_processing']
                 rate = []
                 for container in metric_traces:
-                    values = []
-                    for measurement in metric_traces[container]:
-                        values.append(float(measurement[1]))
-                    print(container, np.mean(values))
-                    rate.append(np.mean(values))
+                    mean = metric_traces[container].mean()
+                    print(container, mean)
+                    rate.append(mean)
                 print('Avg PCAP processing rate:', np.mean(rate))
                 print('Total PCAP processing rate:', sum(rate))
                 self.states['pcap_processing_rate'] = np.mean(rate)
@@ -247,11 +231,9 @@ class PCAPEnvironment:
                 metric_traces = traces['pcap-log-monitor']['event_pcap_rate_ingestion']
                 rate = []
                 for container in metric_traces:
-                    values = []
-                    for measurement in metric_traces[container]:
-                        values.append(float(measurement[1]))
-                    print(container, np.mean(values))
-                    rate.append(np.mean(values))
+                    mean = metric_traces[container].mean()
+                    print(container, mean)
+                    rate.append(mean)
                 print('Avg PCAP ingestion rate:', np.mean(rate))
                 print('Total PCAP ingestion rate:', sum(rate))
                 self.states['pcap_ingestion_rate'] = np.mean(rate)
@@ -264,11 +246,9 @@ class PCAPEnvironment:
                 metric_traces = traces['pcap-log-monitor']['event_pcap_rate']
                 rate = []
                 for container in metric_traces:
-                    values = []
-                    for measurement in metric_traces[container]:
-                        values.append(float(measurement[1]))
-                    print(container, np.mean(values))
-                    rate.append(np.mean(values))
+                    mean = metric_traces[container].mean()
+                    print(container, mean)
+                    rate.append(mean)
                 print('Avg PCAP rate:', np.mean(rate))
                 print('Total PCAP rate:', sum(rate))
                 self.states['pcap_rate'] = np.mean(rate)
@@ -281,11 +261,9 @@ class PCAPEnvironment:
                 metric_traces = traces['tek-log-monitor']['event_tek_rate_processing']
                 rate = []
                 for container in metric_traces:
-                    values = []
-                    for measurement in metric_traces[container]:
-                        values.append(float(measurement[1]))
-                    print(container, np.mean(values))
-                    rate.append(np.mean(values))
+                    mean = metric_traces[container].mean()
+                    print(container, mean)
+                    rate.append(mean)
                 print('Avg TEK processing rate:', np.mean(rate))
                 print('Total TEK processing rate:', sum(rate))
                 self.states['tek_processing_rate'] = np.mean(rate)
@@ -298,11 +276,9 @@ class PCAPEnvironment:
                 metric_traces = traces['tek-log-monitor']['event_tek_rate_ingestion']
                 rate = []
                 for container in metric_traces:
-                    values = []
-                    for measurement in metric_traces[container]:
-                        values.append(float(measurement[1]))
-                    print(container, np.mean(values))
-                    rate.append(np.mean(values))
+                    mean = metric_traces[container].mean()
+                    print(container, mean)
+                    rate.append(mean)
                 print('Avg TEK ingestion rate:', np.mean(rate))
                 print('Total TEK ingestion rate:', sum(rate))
                 self.states['tek_ingestion_rate'] = np.mean(rate)
@@ -315,11 +291,9 @@ class PCAPEnvironment:
                 metric_traces = traces['tek-log-monitor']['event_tek_rate']
                 rate = []
                 for container in metric_traces:
-                    values = []
-                    for measurement in metric_traces[container]:
-                        values.append(float(measurement[1]))
-                    print(container, np.mean(values))
-                    rate.append(np.mean(values))
+                    mean = metric_traces[container].mean()
+                    print(container, mean)
+                    rate.append(mean)
                 print('Avg TEK rate:', np.mean(rate))
                 print('Total TEK rate:', sum(rate))
                 self.states['tek_rate'] = np.mean(rate)
@@ -1,3 +1,6 @@
+from concurrent.futures import ThreadPoolExecutor
+import random
+import re
 import time
 
 import requests
@@ -8,8 +11,12 @@ import json
 
 try:
     from .roundTime import *
+    from .series_cache import SeriesCache
+    from .trace_store import TraceStore
 except ImportError:
     from roundTime import *
+    from series_cache import SeriesCache
+    from trace_store import TraceStore
 
 requests.packages.urllib3.disable_warnings()
 
@@ -22,15 +29,37 @@ class PromCrawler:
     prom_token = None
     step = '15s'
     chunk_sz = 900
+    # chunk requests in flight at once, per crawler
+    max_in_flight = int(os.getenv("PROM_MAX_IN_FLIGHT", 8))
+    max_trials = 3
+    backoff_base = 0.5   # seconds, doubled per failed trial
+    backoff_max = 8.0
 
-    def __init__(self, prom_address=None, prom_token=None):
+    def __init__(self, prom_address=None, prom_token=None, cache=None):
         self.prom_address = prom_address or os.getenv("PROM_HOST")
         self.prom_token = prom_token or os.getenv("PROM_TOKEN")
+        # a SeriesCache, or $PROM_CACHE_DIR: fetch only what the last crawls did not
+        if cache is None and os.getenv("PROM_CACHE_DIR"):
+            cache = SeriesCache(os.getenv("PROM_CACHE_DIR"),
+                                max_age=float(os.getenv("PROM_CACHE_MAX_AGE", 7 * 86400)),
+                                max_bytes=int(os.getenv("PROM_CACHE_MAX_BYTES", 512 * 1024 * 1024)))
+        self.cache = cache
 
         if not self.prom_address or not self.crawling_period:
             raise ValueError(
                 "Please appropriately configure environment variables $PROM_HOST, $PROM_TOKEN, $CRAWLING_PERIOD to successfully run the crawler and profiler!")
 
+        # one keep-alive session for every query, with a connection per worker
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.max_in_flight)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.verify = False
+        self.session.headers.update({"content-type": "application/json; charset=UTF-8"})
+        if self.prom_token:
+            self.session.headers['Authorization'] = 'Bearer {}'.format(self.prom_token)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_in_flight)
+
     def update_period(self, crawling_period):
         self.crawling_period = crawling_period
         self.now = int(roundTime(dt=datetime.now()))
@@ -41,91 +70,108 @@ class PromCrawler:
         current_time_str = datetime.fromtimestamp(self.now).strftime("%I:%M:%S")
         return current_time_str
 
-    def fetch_data_range(self, my_query, start, end):
+    def fetch_chunk(self, my_query, start, end):
+        # the result series; [] when there is no data, None when the request failed
         try:
-            if self.prom_token:
-                headers = {"content-type": "application/json; charset=UTF-8",
-                           'Authorization': 'Bearer {}'.format(self.prom_token)}
-            else:
-                headers = {"content-type": "application/json; charset=UTF-8"}
-            response = requests.get('{0}/api/v1/query_range'.format(self.prom_address),
-                                    params={'query': my_query, 'start': start, 'end': end, 'step': self.step},
-                                    headers=headers, verify=False)
-
+            response = self.session.get('{0}/api/v1/query_range'.format(self.prom_address),
+                                        params={'query': my_query, 'start': start, 'end': end, 'step': self.step})
         except requests.exceptions.RequestException as e:
             print(e)
             return None
 
         try:
-            if response.json()['status'] != "success":
-                print("Error processing the request: " + response.json()['status'])
-                print("The Error is: " + response.json()['error'])
+            body = response.json()
+            if body['status'] != "success":
+                print("Error processing the request: " + body['status'])
+                print("The Error is: " + body['error'])
                 return None
 
-            results = response.json()['data']['result']
-
-            if (results is None):
-                # print("the results[] came back empty!")
-                return None
-
-            length = len(results)
-            if length > 0:
-                return results
-            else:
-                # print("the results[] has no entries!")
-                return None
+            return body['data']['result'] or []
         except:
             print(response)
             return None
 
-    def fetch_data_range_in_chunks(self, my_query):
-        all_metric_history = []
-        for cur_start in range(self.start, self.end, self.chunk_sz):
-            cur_end = cur_start + self.chunk_sz
+    def fetch_data_range(self, my_query, start, end):
+        results = self.fetch_chunk(my_query, start, end)
+        if not results:
+            # print("the results[] came back empty!")
+            return None
+        return results
+
+    def fetch_chunk_with_retries(self, my_query, start, end):
+        for trial in range(self.max_trials):
+            if trial:
+                # full jitter, so failed chunks do not retry in lockstep
+                time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** trial)))
+            results = self.fetch_chunk(my_query, start, end)
+            if results is not None:
+                return results
+        return None
 
-            trials = 0
-            cur_metric_history = None
-            while (cur_metric_history == None) and (trials < 3):
-                cur_metric_history = self.fetch_data_range(my_query, cur_start, cur_end)
-                trials += 1
+    def fetch_data_range_in_chunks(self, my_query):
+        if self.cache is not None:
+            return self.fetch_data_range_cached(my_query)
 
+        starts = range(self.start, self.end, self.chunk_sz)
+        # map() yields in submission order, so the chunks stay in time order
+        chunks = self.executor.map(lambda cur_start: self.fetch_chunk_with_retries(my_query, cur_start, cur_start + self.chunk_sz),
+                                   starts)
+        all_metric_history = []
+        for cur_metric_history in chunks:
             if cur_metric_history is None:
                 continue
-
             all_metric_history += cur_metric_history
 
         return all_metric_history
 
-    def get_promdata(self, query, traces, resourcetype):
+    def fetch_data_range_cached(self, my_query):
+        # fetch the gaps of the window in chunks, then read the whole window from the cache
+        chunks = []
+        for gap_start, gap_end in self.cache.missing(my_query, self.step, self.start, self.end):
+            for cur_start in range(int(gap_start), int(gap_end) + 1, self.chunk_sz):
+                chunks.append((cur_start, min(cur_start + self.chunk_sz, gap_end)))
+        fetched = self.executor.map(lambda chunk: self.fetch_chunk_with_retries(my_query, *chunk), chunks)
+        for chunk, cur_metric_history in zip(chunks, fetched):
+            # a failed chunk is not marked as covered, so the next crawl retries it
+            self.cache.store(my_query, self.step, chunk, cur_metric_history, complete=cur_metric_history is not None)
+        if chunks:
+            self.cache.prune()
+        return self.cache.read(my_query, self.step, self.start, self.end)
+
+    def get_promdata(self, query, traces, resourcetype, resource_label=None):
+        # resource_label: take each series' resource type from this label instead,
+        # e.g. "__name__" when one query selects several metrics
         cur_trace = self.fetch_data_range_in_chunks(query)
 
         # Convert the prometheus data to a list of floats
-        try:
-            metric_obj_attributes = cur_trace[0]["metric"].keys()
-        except:
+        if not cur_trace:
             print("There are no data points for metric query {}.".format(query))
             return traces
 
-        try:
-            metric_obj_attributes = cur_trace[0]["metric"].keys()
-        except:
-            print("There are no data points for metric query {}.".format(query))
-            return traces
-
-        pod_key_name = get_key_name("pod", metric_obj_attributes)
-        container_key_name = get_key_name("container", metric_obj_attributes)
-        ns_key_name = get_key_name("namespace", metric_obj_attributes)
-        if ns_key_name == "":
-            ns_key_name = get_key_name("ns", metric_obj_attributes)
-
-        if pod_key_name == "" or container_key_name == "" or ns_key_name == "":
-            print("[Warning] The metric object returned from Prometheus query {} does not have required attribute tags.".format(query))
-            print("[Warning] The following attributes to the metric should not be empty.")
-            print("[Warning] - pod attribute name: {}".format(pod_key_name))
-            print("[Warning] - container attribute name: {}".format(container_key_name))
-            print("[Warning] - namespace attribute name: {}".format(ns_key_name))
+        # the attribute names of each label set, looked up once
+        key_names = {}
+
+        def attribute_names(metric):
+            # in label order, as get_key_name takes the first match
+            attributes = tuple(metric)
+            if attributes not in key_names:
+                pod_key_name = get_key_name("pod", attributes)
+                container_key_name = get_key_name("container", attributes)
+                ns_key_name = get_key_name("namespace", attributes)
+                if ns_key_name == "":
+                    ns_key_name = get_key_name("ns", attributes)
+
+                if pod_key_name == "" or container_key_name == "" or ns_key_name == "":
+                    print("[Warning] The metric object returned from Prometheus query {} does not have required attribute tags.".format(query))
+                    print("[Warning] The following attributes to the metric should not be empty.")
+                    print("[Warning] - pod attribute name: {}".format(pod_key_name))
+                    print("[Warning] - container attribute name: {}".format(container_key_name))
+                    print("[Warning] - namespace attribute name: {}".format(ns_key_name))
+                key_names[attributes] = (pod_key_name, container_key_name)
+            return key_names[attributes]
 
         for metric_obj in cur_trace:
+            pod_key_name, container_key_name = attribute_names(metric_obj["metric"])
             try:
                 pod = metric_obj["metric"][pod_key_name]
             except:
@@ -141,9 +187,14 @@ class PromCrawler:
             except:
                 continue
 
+            resource = metric_obj["metric"].get(resource_label, resourcetype) if resource_label else resourcetype
             metrics = metric_obj['values']
-            traces = construct_nested_dict(traces, container, resourcetype, pod)
-            traces[container][resourcetype][pod] += metrics
+            if isinstance(traces, TraceStore):
+                # decoded into arrays once, here
+                traces.add(container, resource, pod, metrics)
+                continue
+            traces = construct_nested_dict(traces, container, resource, pod)
+            traces[container][resource][pod] += metrics
         return traces
 
 
@@ -165,6 +216,13 @@ def construct_nested_dict(traces_dict, container, resourcetype, pod=None):
     return traces_dict
 
 
+def label_regex(values):
+    """A PromQL regex matching exactly the given label values, for a =~ selector."""
+    escaped = [re.sub(r'([\\.+*?()|\[\]{}^$])', r'\\\1', value) for value in values]
+    # and the backslashes once more for the double-quoted PromQL string
+    return "|".join(escaped).replace('\\', '\\\\').replace('"', '\\"')
+
+
 def get_key_name(attribute, klist):
     keys = [kname for kname in klist if attribute in kname.lower()]
     if len(keys) > 0:
@@ -0,0 +1,232 @@
+import hashlib
+import json
+import math
+import os
+import shutil
+import time
+
+import numpy as np
+
+
+def parse_step(step):
+    """'15s', '1m', '2h' or 15 -> seconds."""
+    if isinstance(step, (int, float)):
+        return float(step)
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    for unit in sorted(units, key=len, reverse=True):
+        if step.endswith(unit):
+            return float(step[:-len(unit)]) * units[unit]
+    return float(step)
+
+
+def format_value(value):
+    # the way Prometheus prints sample values, so int("1024") still works
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+def format_timestamp(ms):
+    return int(ms // 1000) if ms % 1000 == 0 else ms / 1000.0
+
+
+def merge_intervals(intervals, step):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + step:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class SeriesCache:
+    """
+    On-disk cache of Prometheus range query results.
+
+    Each query (and step) has a directory with meta.json (the query, the
+    covered time intervals and the label set of every series) and two files
+    per series: int64 timestamps in milliseconds and float64 values, sorted
+    by time and read through np.memmap. missing() tells which parts of a
+    window still need fetching. store() merges fetched samples, newer values
+    replacing older ones at the same timestamp. Samples older than max_age
+    seconds are dropped. The least recently used queries are evicted while
+    the cache is above max_bytes.
+
+    Only intervals older than `settle` seconds are recorded as covered; the
+    newest samples are still returned but fetched again next time, since
+    Prometheus may not have scraped them yet. One process per directory.
+    """
+
+    def __init__(self, directory, max_age=7 * 86400, max_bytes=512 * 1024 * 1024, settle=60):
+        self.directory = directory
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.settle = settle
+        os.makedirs(directory, exist_ok=True)
+        self.metas = {}
+
+    def key(self, query, step):
+        return hashlib.sha1(("%s\n%s" % (query, step)).encode("utf-8")).hexdigest()[:20]
+
+    def path(self, key, *names):
+        return os.path.join(self.directory, key, *names)
+
+    def meta(self, query, step):
+        key = self.key(query, step)
+        if key not in self.metas:
+            try:
+                with open(self.path(key, "meta.json")) as f:
+                    self.metas[key] = json.load(f)
+            except (OSError, ValueError):
+                self.metas[key] = {'query': query, 'step': step, 'covered': [], 'series': {}, 'last_access': 0}
+        return key, self.metas[key]
+
+    def save_meta(self, key):
+        os.makedirs(self.path(key), exist_ok=True)
+        temporary = self.path(key, "meta.json.tmp")
+        with open(temporary, "w") as f:
+            json.dump(self.metas[key], f)
+        os.replace(temporary, self.path(key, "meta.json"))
+
+    def missing(self, query, step, start, end):
+        """The [start, end] intervals of the window not in the cache, on the step grid."""
+        step_s = parse_step(step)
+        _, meta = self.meta(query, step)
+        gaps = []
+        cursor = start
+        for covered_start, covered_end in meta['covered']:
+            if covered_end < cursor:
+                continue
+            if covered_start > end:
+                break
+            if covered_start > cursor:
+                gaps.append((cursor, min(end, covered_start - step_s)))
+            cursor = max(cursor, covered_end + step_s)
+        if cursor <= end:
+            gaps.append((cursor, end))
+        return [(gap_start, gap_end) for gap_start, gap_end in gaps if gap_start <= gap_end]
+
+    def load_series(self, key, series_id):
+        try:
+            timestamps = np.memmap(self.path(key, series_id + ".ts"), dtype=np.int64, mode="r")
+            values = np.memmap(self.path(key, series_id + ".val"), dtype=np.float64, mode="r")
+        except (OSError, ValueError):
+            # missing or empty
+            return np.empty(0, np.int64), np.empty(0, np.float64)
+        length = min(len(timestamps), len(values))
+        return timestamps[:length], values[:length]
+
+    def file_sizes(self, key, series_id):
+        return tuple(os.path.getsize(path) if os.path.exists(path) else 0
+                     for path in (self.path(key, series_id + ".ts"), self.path(key, series_id + ".val")))
+
+    def write_series(self, key, series_id, timestamps, values):
+        for suffix, array in ((".ts", timestamps), (".val", values)):
+            temporary = self.path(key, series_id + suffix + ".tmp")
+            np.ascontiguousarray(array).tofile(temporary)
+            os.replace(temporary, self.path(key, series_id + suffix))
+
+    def store(self, query, step, interval, results, complete=True):
+        """Merge the series fetched for ``interval``; cover it when ``complete``."""
+        key, meta = self.meta(query, step)
+        os.makedirs(self.path(key), exist_ok=True)
+        for series in results or []:
+            labels = series['metric']
+            series_id = hashlib.sha1(json.dumps(labels, sort_keys=True).encode("utf-8")).hexdigest()[:20]
+            meta['series'].setdefault(series_id, labels)
+            new_ts = np.array([round(float(t) * 1000) for t, _ in series['values']], dtype=np.int64)
+            new_values = np.array([float(v) for _, v in series['values']], dtype=np.float64)
+            old_ts, old_values = self.load_series(key, series_id)
+            # an interrupted append leaves the two files of different lengths;
+            # appending to them would pair every later timestamp with the wrong value
+            ts_size, values_size = self.file_sizes(key, series_id)
+            if ts_size == values_size and len(old_ts) and len(new_ts) and new_ts[0] <= old_ts[-1]:
+                # adjacent chunks share their boundary sample: drop the
+                # samples the cache already holds with the same values
+                overlap = np.searchsorted(new_ts, old_ts[-1], side="right")
+                held = np.searchsorted(old_ts, new_ts[0], side="left")
+                if np.array_equal(new_ts[:overlap], old_ts[held:]) \
+                        and np.array_equal(new_values[:overlap], old_values[held:], equal_nan=True):
+                    new_ts, new_values = new_ts[overlap:], new_values[overlap:]
+            if ts_size == values_size and (not len(old_ts) or not len(new_ts) or new_ts[0] > old_ts[-1]):
+                # the usual case: a newer tail, appended in place
+                for suffix, array in ((".ts", new_ts), (".val", new_values)):
+                    with open(self.path(key, series_id + suffix), "ab") as f:
+                        array.tofile(f)
+                continue
+            timestamps = np.concatenate([new_ts, np.asarray(old_ts)])
+            values = np.concatenate([new_values, np.asarray(old_values)])
+            # stable sort keeps the fetched sample first among equal timestamps
+            order = np.argsort(timestamps, kind="stable")
+            timestamps, values = timestamps[order], values[order]
+            first = np.ones(len(timestamps), dtype=bool)
+            first[1:] = timestamps[1:] != timestamps[:-1]
+            del old_ts, old_values
+            self.write_series(key, series_id, timestamps[first], values[first])
+
+        step_s = parse_step(step)
+        settled = min(interval[1], time.time() - self.settle)
+        if complete and interval[0] <= settled:
+            # on the step grid of the interval, so the next gap starts on it too
+            covered_end = interval[0] + math.floor((settled - interval[0]) / step_s) * step_s
+            meta['covered'] = merge_intervals(meta['covered'] + [[interval[0], covered_end]], step_s)
+        meta['last_access'] = time.time()
+        self.save_meta(key)
+
+    def read(self, query, step, start, end):
+        """The cached series with samples in [start, end], as query_range results."""
+        key, meta = self.meta(query, step)
+        meta['last_access'] = time.time()
+        results = []
+        for series_id, labels in meta['series'].items():
+            timestamps, values = self.load_series(key, series_id)
+            lo = np.searchsorted(timestamps, start * 1000, side="left")
+            hi = np.searchsorted(timestamps, end * 1000, side="right")
+            if hi <= lo:
+                continue
+            results.append({'metric': labels,
+                            'values': [[format_timestamp(int(t)), format_value(float(v))]
+                                       for t, v in zip(timestamps[lo:hi], values[lo:hi])]})
+        return results
+
+    def prune(self):
+        """Drop samples older than max_age, then evict queries while over max_bytes."""
+        cutoff = time.time() - self.max_age
+        sizes = {}
+        for key in os.listdir(self.directory):
+            try:
+                with open(self.path(key, "meta.json")) as f:
+                    meta = self.metas.get(key) or json.load(f)
+            except (OSError, ValueError):
+                continue
+            self.metas[key] = meta
+            if meta['covered'] and meta['covered'][0][0] < cutoff:
+                step_s = parse_step(meta['step'])
+                # the first covered sample at or after the cutoff, on the interval's grid
+                meta['covered'] = [[s + max(0, math.ceil((cutoff - s) / step_s)) * step_s, e]
+                                   for s, e in meta['covered'] if e >= cutoff]
+                for series_id in list(meta['series']):
+                    timestamps, values = self.load_series(key, series_id)
+                    keep = np.searchsorted(timestamps, cutoff * 1000)
+                    if keep == len(timestamps):
+                        del meta['series'][series_id]
+                        for suffix in (".ts", ".val"):
+                            if os.path.exists(self.path(key, series_id + suffix)):
+                                os.remove(self.path(key, series_id + suffix))
+                    elif keep:
+                        self.write_series(key, series_id, np.array(timestamps[keep:]), np.array(values[keep:]))
+                self.save_meta(key)
+            sizes[key] = sum(os.path.getsize(self.path(key, name)) for name in os.listdir(self.path(key)))
+
+        total = sum(sizes.values())
+        for key in sorted(sizes, key=lambda k: self.metas[k].get('last_access', 0)):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self.path(key), ignore_errors=True)
+            self.metas.pop(key, None)
+            total -= sizes[key]
@@ -0,0 +1,124 @@
+import numpy as np
+
+
+class Trace:
+    """
+    The samples of one series as float64 timestamp and value arrays.
+
+    Prometheus results are decoded once, on add(); appended batches are
+    joined into one contiguous array the first time they are read. A sample
+    takes 16 bytes instead of a [ts, "str"] list of about 150.
+    """
+    __slots__ = ('_timestamps', '_values', '_pending')
+
+    def __init__(self):
+        self._timestamps = np.empty(0, np.float64)
+        self._values = np.empty(0, np.float64)
+        self._pending = []
+
+    def add(self, samples):
+        """Append Prometheus [[ts, "value"], ...] samples."""
+        if not len(samples):
+            return
+        timestamps = np.fromiter((sample[0] for sample in samples), np.float64, len(samples))
+        # numpy parses the value strings, "NaN" and "+Inf" included
+        values = np.array([sample[1] for sample in samples], dtype=np.float64)
+        self._pending.append((timestamps, values))
+
+    def add_arrays(self, timestamps, values):
+        self._pending.append((np.asarray(timestamps, np.float64), np.asarray(values, np.float64)))
+
+    def _consolidate(self):
+        if self._pending:
+            self._timestamps = np.concatenate([self._timestamps] + [t for t, _ in self._pending])
+            self._values = np.concatenate([self._values] + [v for _, v in self._pending])
+            self._pending = []
+
+    @property
+    def timestamps(self):
+        self._consolidate()
+        return self._timestamps
+
+    @property
+    def values(self):
+        self._consolidate()
+        return self._values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __iter__(self):
+        # [ts, value] pairs, for code written against the nested lists
+        return iter(np.column_stack((self.timestamps, self.values)).tolist())
+
+    def mean(self):
+        return float(np.mean(self.values)) if len(self) else float('nan')
+
+    def max(self):
+        return float(np.max(self.values)) if len(self) else float('nan')
+
+    def percentile(self, q):
+        """q in [0, 100]; a list of them gives an array."""
+        if not len(self):
+            return float('nan')
+        return np.percentile(self.values, q)
+
+    def rate(self):
+        """Per-second increase of a counter over the trace, counter resets included."""
+        values, timestamps = self.values, self.timestamps
+        if len(values) < 2 or timestamps[-1] == timestamps[0]:
+            return float('nan')
+        deltas = np.diff(values)
+        # after a reset the counter restarts from zero, so its new value is the increase
+        increase = np.where(deltas < 0, values[1:], deltas).sum()
+        return float(increase / (timestamps[-1] - timestamps[0]))
+
+    def nbytes(self):
+        return self.timestamps.nbytes + self.values.nbytes
+
+
+class TraceStore:
+    """
+    Traces indexed by (container, resource, pod).
+
+    store[container][resource][pod] is a Trace, as with the nested dicts
+    get_promdata used to build, and `container in store` works the same way.
+    """
+
+    def __init__(self):
+        self.series = {}  # container -> resource -> pod -> Trace
+
+    def trace(self, container, resource, pod):
+        """The Trace of (container, resource, pod), created empty on first use."""
+        pods = self.series.setdefault(container, {}).setdefault(resource, {})
+        if pod not in pods:
+            pods[pod] = Trace()
+        return pods[pod]
+
+    def add(self, container, resource, pod, samples):
+        self.trace(container, resource, pod).add(samples)
+
+    def get(self, container, resource, pod):
+        return self.series.get(container, {}).get(resource, {}).get(pod)
+
+    def __contains__(self, container):
+        return container in self.series
+
+    def __getitem__(self, container):
+        return self.series[container]
+
+    def keys(self):
+        return self.series.keys()
+
+    def items(self):
+        for container, resources in self.series.items():
+            for resource, pods in resources.items():
+                for pod, trace in pods.items():
+                    yield (container, resource, pod), trace
+
+    def pod_means(self, container, resource):
+        """{pod: mean} of one container's resource; empty when it has no data."""
+        return {pod: trace.mean() for pod, trace in self.series.get(container, {}).get(resource, {}).items()}
+
+    def nbytes(self):
+        return sum(trace.nbytes() for _, trace in self.items())
@@ -1,7 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import json
 import subprocess
 import time
+
+import wrk2_results
 # Prometheus API 的 URL
 PROMETHEUS = 'http://127.0.0.1:9090'  # 替换 <Node-IP> 为您的节点 IP 地址
 NODE = 'http://127.0.0.1:33126/?function=ABD'
@@ -18,10 +21,25 @@ def start_port_forward(deployment, local_port, target_port):
     subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     #subprocess.Popen(command1, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-def get_pods():
+# 每个 Pod 采集的指标 (PromQL 模板)
+QUERIES = {
+    'cpu': 'rate(container_cpu_usage_seconds_total{{pod="{pod}"}}[30s])',
+    'memory': 'container_memory_usage_bytes{{pod="{pod}"}}',
+    'max_memory': 'max_over_time(container_memory_usage_bytes{{pod="{pod}"}}[30s])',
+    'energy': 'rate(kepler_container_joules_total{{pod_name="{pod}",mode="dynamic"}}[30s])',
+}
+
+# 所有查询共用一个连接池
+SESSION = requests.Session()
+
+def get_pods(prefix="final"):
     pods = []  # 创建一个空列表来存储 Pod 名称
     # 使用 subprocess 执行 kubectl 命令并捕获输出
-    result = subprocess.run(["kubectl", "get", "pods", "-A"], stdout=subprocess.PIPE, text=True)
+    try:
+        result = subprocess.run(["kubectl", "get", "pods", "-A"], stdout=subprocess.PIPE, text=True)
+    except OSError as e:
+        print(f"Failed to execute kubectl command: {e}")
+        return pods
     
     # 检查命令是否成功执行
     if result.returncode != 0:
@@ -32,8 +50,8 @@ def get_pods():
     for line in result.stdout.split('\n'):
         # 分割每一行到列
         columns = line.split()
-        # 检查列是否足够多以及 Pod 名称是否以 "base64" 开头
-        if len(columns) >= 2 and columns[1].startswith("final"):
+        # 检查列是否足够多以及 Pod 名称是否以 prefix 开头
+        if len(columns) >= 2 and columns[1].startswith(prefix):
             pods.append(columns[1])  # 添加符合条件的 Pod 名称到列表
 
     return pods
@@ -42,54 +60,76 @@ def get_prometheus_data(query):
     """
     使用给定的 PromQL 查询从 Prometheus 获取数据。
     """
-    response = requests.get(f'{PROMETHEUS}/api/v1/query', params={'query': query})
+    response = SESSION.get(f'{PROMETHEUS}/api/v1/query', params={'query': query})
     if response.status_code == 200:
         return response.json()
     else:
         raise Exception(f"Query failed with status code {response.status_code}")
 
-def run_wrk2(url, duration='60', threads=1, connections=1, rate=5):
+def get_prometheus_range(query, start, end, step=1):
+    """
+    获取 [start, end] 时间窗口内的数据 (query_range)。
+    """
+    params = {'query': query, 'start': start, 'end': end, 'step': step}
+    response = SESSION.get(f'{PROMETHEUS}/api/v1/query_range', params=params)
+    if response.status_code == 200:
+        return response.json()
+    else:
+        raise Exception(f"Range query failed with status code {response.status_code}")
+
+def collect_metrics(pods, start=None, end=None, step=1, workers=8):
+    """
+    并发查询所有 Pod 的 QUERIES；返回 {pod: {metric: [[ts, value], ...]}}。
+    不给 start/end 时查询当前值。
+    """
+    def fetch(pod, metric):
+        query = QUERIES[metric].format(pod=pod)
+        try:
+            if start is None:
+                data = get_prometheus_data(query)
+                return [result["value"] for result in data["data"]["result"]]
+            data = get_prometheus_range(query, start, end, step)
+            return [value for result in data["data"]["result"] for value in result["values"]]
+        except Exception as e:
+            print(f"Error occurred while querying {metric} of {pod}: {e}")
+            return None
+
+    metrics = {pod: {} for pod in pods}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {(pod, metric): executor.submit(fetch, pod, metric) for pod in pods for metric in QUERIES}
+        for (pod, metric), future in futures.items():
+            metrics[pod][metric] = future.result()
+    return metrics
+
+def run_wrk2(url, duration='60', threads=1, connections=1, rate=5, function=None, store=None, script=None):
     """
     使用 wrk2 测试给定 URL 的性能。
+    返回解析后的结果 (wrk2_results.parse_wrk2)；给定 store 时追加到结果库。
     """
-    command = f'wrk -t{threads} -c{connections} -d{duration} -R{rate} --latency {url} > latency_output.txt'
+    command = ['wrk', f'-t{threads}', f'-c{connections}', f'-d{duration}', f'-R{rate}', '--latency', url]
+    if script:
+        # Lua 脚本, 例如 POST 请求体
+        command[1:1] = ['-s', script]
     try:
         # 运行 wrk2 命令
         print("Starting wrk2 performance test...")
-        subprocess.run(command, shell=True, check=True)
+        completed = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True)
         print("wrk2 performance test completed.")
-    except subprocess.CalledProcessError as e:
+    except (OSError, subprocess.CalledProcessError) as e:
         print(f"Error occurred during wrk2 test: {e}")
-        
-if __name__ == "__main__":
-    try:
-        #start_port_forward('base64-app', '33125', '8000')
-        #print("Port forwarding started. Waiting for it to take effect...")
-        #time.sleep(10)
-        pods = get_pods()
-        print(pods)
-        if pods:
-            pod_name = pods[0]
-            CPU_QUERY = f'rate(container_cpu_usage_seconds_total{{pod="{pod_name}"}}[30s])'
-            MEM_QUERY = f'container_memory_usage_bytes{{pod="{pod_name}"}}'
-            MAX_MEM_QUERY = f'max_over_time(container_memory_usage_bytes{{pod="{pod_name}"}}[30s])'
-            test_Q = f'rate(kepler_container_joules_total{{pod_name="{pod_name}",mode="dynamic"}}[30s])'
-        #run_wrk2(NODE)
-        cpu_data = get_prometheus_data(CPU_QUERY)
-        print(cpu_data)
-        cpu_values = [result["value"] for result in cpu_data["data"]["result"]]
-        print(cpu_values)
-        cpu = cpu_values[0][1]
-        print(cpu)
-        test = get_prometheus_data(test_Q)
-        energy_data =  [result["value"] for result in test["data"]["result"]]
-        energy_value = energy_data[0]
-        print(energy_value)
-        memory_data = get_prometheus_data(MEM_QUERY)
-        memory_values = [result["value"] for result in memory_data["data"]["result"]]
-        memory = memory_values[0][1]
-        print(memory)
-        
-    except Exception as e:
-        print(f"Error occurred: {e}")
+        return None
+    # 原始输出仍保存在 latency_output.txt
+    with open('latency_output.txt', 'w') as f:
+        f.write(completed.stdout)
+    record = wrk2_results.parse_wrk2(completed.stdout, target_rate=rate)
+    if not record['valid']:
+        print("wrk2 run is invalid: " + "; ".join(record['invalid_reasons']))
+    if store is not None:
+        store.append(record, function=function, source=url)
+    return record
 
+if __name__ == "__main__":
+    # 当前所有目标 Pod 的指标；参数扫描见 sweep.py
+    pods = get_pods()
+    print(pods)
+    print(json.dumps(collect_metrics(pods), indent=2))
@@ -0,0 +1,167 @@
+"""
+Run a declarative rate/concurrency sweep against the deployed functions.
+
+A sweep file (JSON) names the functions and the values to sweep:
+
+    {
+      "functions": {
+        "base64": {"url": "http://127.0.0.1:30001/", "pod_prefix": "base64-app"},
+        "json": {"url": "http://127.0.0.1:30001/", "pod_prefix": "json-app",
+                 "body": "faas-functions-on-k8s/json/json-data.json"}
+      },
+      "rates": [5, 50, 200], "threads": [1, 2], "connections": [1, 8], "replicas": 3,
+      "warmup": 10, "duration": 60, "cooldown": 15
+    }
+
+Every function x rate x threads x connections x replica point is one load
+phase: a wrk2 warm-up run whose result is discarded, the measured wrk2 run
+(appended to the wrk2_results store), then a cool-down. After each phase the
+CPU, memory and energy series of every pod of the function over the
+measured window are fetched from Prometheus. The fetches run concurrently,
+in the background while the next phase starts. They are written as JSON
+lines next to the store row of the run.
+
+    python sweep.py sweep.json --dry-run     # the plan and how long it takes
+    python sweep.py sweep.json --resume      # skip points that already have enough valid runs
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import script_data
+import wrk2_results
+
+DEFAULTS = {
+    'rates': [5], 'threads': [1], 'connections': [1], 'replicas': 1,
+    'warmup': 10, 'duration': 60, 'cooldown': 15,
+    # Prometheus needs a scrape interval or so to see the end of a window
+    'collect_delay': 15, 'step': 1,
+    'store': 'wrk2-results', 'metrics': 'sweep-metrics.jsonl',
+}
+
+POST_SCRIPT = """wrk.method = "POST"
+wrk.headers["Content-Type"] = "application/json"
+local f = assert(io.open(%s, "rb"))
+wrk.body = f:read("*a")
+f:close()
+"""
+
+
+def load_sweep(path):
+    with open(path) as f:
+        sweep = dict(DEFAULTS, **json.load(f))
+    if not sweep.get('functions'):
+        raise ValueError("the sweep names no functions")
+    for name, spec in sweep['functions'].items():
+        if 'url' not in spec:
+            raise ValueError("function %s has no url" % name)
+        spec.setdefault('pod_prefix', name)
+    return sweep
+
+
+def points(sweep):
+    """(function, rate, threads, connections, replica) in run order."""
+    for function in sweep['functions']:
+        for rate, threads, connections, replica in itertools.product(
+                sweep['rates'], sweep['threads'], sweep['connections'], range(sweep['replicas'])):
+            # wrk2 needs a connection per thread
+            if connections >= threads:
+                yield function, rate, threads, connections, replica
+
+
+def lua_script(name, spec, directory):
+    """A wrk2 script sending the function's body, or None for GET."""
+    if not spec.get('body'):
+        return None
+    # named after the function: two bodies may share a file name
+    path = os.path.join(directory, "%s.lua" % name)
+    with open(path, "w") as f:
+        f.write(POST_SCRIPT % json.dumps(os.path.abspath(spec['body'])))
+    return path
+
+
+def completed_runs(store, point):
+    function, rate, threads, connections, _ = point
+    return len(store.select(function, float(rate), float(threads), float(connections), valid=True))
+
+
+def collect(sweep, key, pods, start, end, output, lock):
+    # wait until Prometheus has scraped the end of the window
+    delay = end + sweep['collect_delay'] - time.time()
+    if delay > 0:
+        time.sleep(delay)
+    metrics = script_data.collect_metrics(pods, start, end, sweep['step'])
+    with lock:
+        with open(output, "a") as f:
+            f.write(json.dumps(dict(key, start=start, end=end, metrics=metrics)) + "\n")
+
+
+def run(sweep, args):
+    # a dry run only reads an existing store, and does not create one
+    store = None
+    if not args.dry_run or (args.resume and os.path.isdir(sweep['store'])):
+        store = wrk2_results.ResultStore(sweep['store'])
+    plan = list(points(sweep))
+    if args.resume and store is not None:
+        # replicas already done count against the replica index
+        plan = [p for p in plan if completed_runs(store, p) <= p[4]]
+    phase = sweep['warmup'] + sweep['duration'] + sweep['cooldown']
+    print("%d load phases, about %.1f hours" % (len(plan), len(plan) * phase / 3600.0))
+    if args.dry_run:
+        for point in plan:
+            print("%s rate=%s threads=%s connections=%s replica=%s" % point)
+        return
+
+    lock = threading.Lock()
+    collectors = ThreadPoolExecutor(max_workers=2)
+    pending = []
+    with tempfile.TemporaryDirectory() as scripts:
+        lua = {name: lua_script(name, spec, scripts) for name, spec in sweep['functions'].items()}
+        for i, (function, rate, threads, connections, replica) in enumerate(plan):
+            spec = sweep['functions'][function]
+            print("[%d/%d] %s rate=%s threads=%s connections=%s replica=%s" % (
+                i + 1, len(plan), function, rate, threads, connections, replica))
+            if sweep['warmup']:
+                script_data.run_wrk2(spec['url'], '%ds' % sweep['warmup'], threads, connections, rate,
+                                     script=lua[function])
+
+            start = time.time()
+            record = script_data.run_wrk2(spec['url'], '%ds' % sweep['duration'], threads, connections, rate,
+                                          function=function, store=store, script=lua[function])
+            end = time.time()
+            key = {'function': function, 'rate': rate, 'threads': threads, 'connections': connections,
+                   'replica': replica, 'row': store.rows - 1 if record is not None else None,
+                   'valid': record is not None and record['valid']}
+            pods = script_data.get_pods(spec['pod_prefix'])
+            pending.append(collectors.submit(collect, sweep, key, pods, start, end, sweep['metrics'], lock))
+
+            if sweep['cooldown'] and i + 1 < len(plan):
+                time.sleep(sweep['cooldown'])
+
+        for future in pending:
+            future.result()
+    collectors.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a rate/concurrency sweep with wrk2 and collect Prometheus metrics.")
+    parser.add_argument("sweep", help="sweep file (JSON)")
+    parser.add_argument("--dry-run", action="store_true", help="print the plan without running it")
+    parser.add_argument("--resume", action="store_true", help="skip points that already have their valid runs")
+    args = parser.parse_args()
+    try:
+        sweep = load_sweep(args.sweep)
+    except (OSError, ValueError) as e:
+        print("Error occurred: %s" % e)
+        sys.exit(1)
+    run(sweep, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""
+Parse wrk2 output and keep the runs in an append-only columnar store.
+
+parse_wrk2() turns the text wrk2 prints (with --latency) into a record:
+the thread stats, the corrected latency percentiles (and the uncorrected
+ones with -U), requests, req/s, socket errors, non-2xx responses and the
+thread calibration. A run is flagged invalid, with the reasons, when
+calibration failed (wrk2 reports a mean latency of INT64_MAX ms when no
+response came back), no request completed, sockets failed, responses were
+not 2xx/3xx, or the achieved rate fell short of the target.
+
+ResultStore keeps one file per column in a directory: numbers as float64
+(NaN when missing), strings as int32 codes into a dictionary file. A record
+is appended to every column, and on open the shortest column decides the
+row count, so an interrupted append is discarded. Rows are indexed by
+(function, rate, threads, connections).
+
+    python wrk2_results.py parse latency_output.txt
+    python wrk2_results.py ingest latency_output.txt --function base64 --rate 5
+    python wrk2_results.py show --function base64 --invalid
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+PERCENTILES = (50.0, 75.0, 90.0, 99.0, 99.9, 99.99, 99.999, 100.0)
+# the achieved rate may fall this far below the target before a run is invalid
+RATE_TOLERANCE = 0.9
+# wrk2 prints INT64_MAX as the mean latency of a calibration without responses
+CALIBRATION_MAX_MS = 1e12
+
+TIME_UNITS = {'us': 0.001, 'ms': 1.0, 's': 1000.0, 'm': 60000.0, 'h': 3600000.0}
+BYTE_UNITS = {'B': 1, 'KB': 1024, 'MB': 1024 ** 2, 'GB': 1024 ** 3, 'TB': 1024 ** 4}
+
+
+def percentile_column(p):
+    return "p%s_ms" % ("%g" % p).replace(".", "_")
+
+
+STRING_COLUMNS = ('function', 'url', 'invalid_reasons', 'source')
+NUMBER_COLUMNS = (
+    'timestamp', 'rate', 'threads', 'connections', 'duration', 'valid',
+    'requests', 'elapsed', 'bytes_read', 'requests_per_sec', 'transfer_per_sec',
+    'latency_mean_ms', 'latency_stdev_ms', 'latency_max_ms',
+    'errors_connect', 'errors_read', 'errors_write', 'errors_timeout', 'non_2xx',
+) + tuple(percentile_column(p) for p in PERCENTILES)
+INDEX_COLUMNS = ('function', 'rate', 'threads', 'connections')
+
+
+def to_ms(text):
+    """"1.23ms", "450.00us", "-nanus" -> milliseconds (None for nan)."""
+    match = re.fullmatch(r"(-?nan|[\d.]+)(us|ms|s|m|h)", text.strip())
+    if not match or "nan" in match.group(1):
+        return None
+    return float(match.group(1)) * TIME_UNITS[match.group(2)]
+
+
+def to_bytes(text):
+    match = re.fullmatch(r"([\d.]+)([KMGT]?B)", text.strip())
+    return float(match.group(1)) * BYTE_UNITS[match.group(2)] if match else None
+
+
+def parse_percentiles(lines):
+    percentiles = {}
+    for line in lines:
+        match = re.match(r"\s*([\d.]+)%\s+(\S+)\s*$", line)
+        if not match:
+            break
+        percentiles[float(match.group(1))] = to_ms(match.group(2))
+    return percentiles
+
+
+def parse_wrk2(text, target_rate=None):
+    """Parse one wrk2 run; a dict with 'valid' and 'invalid_reasons'."""
+    record = {
+        'url': None, 'duration': None, 'threads': None, 'connections': None, 'rate': target_rate,
+        'calibration': [], 'latency_mean_ms': None, 'latency_stdev_ms': None, 'latency_max_ms': None,
+        'percentiles': {}, 'uncorrected_percentiles': {}, 'requests': None, 'elapsed': None,
+        'bytes_read': None, 'requests_per_sec': None, 'transfer_per_sec': None,
+        'errors': {'connect': 0, 'read': 0, 'write': 0, 'timeout': 0}, 'non_2xx': 0,
+    }
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        match = re.match(r"Running (\S+) test @ (\S+)", stripped)
+        if match:
+            record['duration'] = to_ms(match.group(1)) / 1000 if to_ms(match.group(1)) is not None else None
+            record['url'] = match.group(2)
+            continue
+        match = re.match(r"(\d+) threads and (\d+) connections", stripped)
+        if match:
+            record['threads'], record['connections'] = int(match.group(1)), int(match.group(2))
+            continue
+        match = re.match(r"Thread calibration: mean lat\.: (\S+?)ms, rate sampling interval: (\d+)ms", stripped)
+        if match:
+            record['calibration'].append({'mean_ms': float(match.group(1)), 'interval_ms': int(match.group(2))})
+            continue
+        if stripped.startswith("Latency ") and not stripped.startswith("Latency Distribution"):
+            fields = stripped.split()
+            if len(fields) >= 4:
+                record['latency_mean_ms'], record['latency_stdev_ms'], record['latency_max_ms'] = (
+                    to_ms(fields[1]), to_ms(fields[2]), to_ms(fields[3]))
+            continue
+        if stripped.startswith("Latency Distribution"):
+            key = 'uncorrected_percentiles' if "Uncorrected" in stripped else 'percentiles'
+            record[key] = parse_percentiles(lines[i + 1:])
+            continue
+        match = re.match(r"(\d+) requests in ([\d.]+\w+), (\S+) read", stripped)
+        if match:
+            record['requests'] = int(match.group(1))
+            elapsed = to_ms(match.group(2))
+            record['elapsed'] = elapsed / 1000 if elapsed is not None else None
+            record['bytes_read'] = to_bytes(match.group(3))
+            continue
+        match = re.match(r"Socket errors: connect (\d+), read (\d+), write (\d+), timeout (\d+)", stripped)
+        if match:
+            record['errors'] = dict(zip(('connect', 'read', 'write', 'timeout'), map(int, match.groups())))
+            continue
+        match = re.match(r"Non-2xx or 3xx responses: (\d+)", stripped)
+        if match:
+            record['non_2xx'] = int(match.group(1))
+            continue
+        match = re.match(r"Requests/sec:\s+([\d.]+)", stripped)
+        if match:
+            record['requests_per_sec'] = float(match.group(1))
+            continue
+        match = re.match(r"Transfer/sec:\s+(\S+)", stripped)
+        if match:
+            record['transfer_per_sec'] = to_bytes(match.group(1))
+
+    reasons = validate(record)
+    record['valid'] = not reasons
+    record['invalid_reasons'] = reasons
+    return record
+
+
+def validate(record):
+    reasons = []
+    if record['requests'] is None:
+        reasons.append("no summary line, the run did not finish")
+    if any(c['mean_ms'] >= CALIBRATION_MAX_MS or math.isnan(c['mean_ms']) for c in record['calibration']):
+        reasons.append("thread calibration failed")
+    if not record['requests']:
+        reasons.append("no requests completed")
+    if record['latency_mean_ms'] is None:
+        reasons.append("latency is nan")
+    errors = sum(record['errors'].values())
+    if errors:
+        reasons.append("%d socket errors" % errors)
+    if record['non_2xx']:
+        reasons.append("%d non-2xx/3xx responses" % record['non_2xx'])
+    if record['rate'] and record['requests_per_sec'] is not None \
+            and record['requests_per_sec'] < record['rate'] * RATE_TOLERANCE:
+        reasons.append("achieved %.2f req/s of %g" % (record['requests_per_sec'], record['rate']))
+    return reasons
+
+
+def flatten(record):
+    """The store columns of a parsed record."""
+    row = {name: record.get(name) for name in NUMBER_COLUMNS + STRING_COLUMNS}
+    row['valid'] = 1.0 if record['valid'] else 0.0
+    row['invalid_reasons'] = "; ".join(record['invalid_reasons'])
+    for kind, count in record['errors'].items():
+        row['errors_' + kind] = count
+    for p in PERCENTILES:
+        row[percentile_column(p)] = record['percentiles'].get(p)
+    return row
+
+
+class ResultStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.dictionary_path = os.path.join(directory, "strings.json")
+        if os.path.exists(self.dictionary_path):
+            with open(self.dictionary_path) as f:
+                self.strings = json.load(f)
+        else:
+            self.strings = []
+        self.codes = {s: i for i, s in enumerate(self.strings)}
+        self.columns = {}
+        self.load()
+
+    def path(self, name):
+        return os.path.join(self.directory, name + ".col")
+
+    def dtype(self, name):
+        return np.int32 if name in STRING_COLUMNS else np.float64
+
+    def load(self):
+        names = NUMBER_COLUMNS + STRING_COLUMNS
+        for name in names:
+            path = self.path(name)
+            self.columns[name] = np.fromfile(path, dtype=self.dtype(name)) if os.path.exists(path) \
+                else np.empty(0, self.dtype(name))
+        self.rows = min(len(column) for column in self.columns.values())
+        for name in names:
+            # the tail of an interrupted append, partial items included
+            size = self.rows * np.dtype(self.dtype(name)).itemsize
+            path = self.path(name)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                self.columns[name] = self.columns[name][:self.rows]
+                with open(path, "r+b") as f:
+                    f.truncate(size)
+        self.build_index()
+
+    def build_index(self):
+        self.index = {}
+        keys = zip(*(self.column(name) for name in INDEX_COLUMNS))
+        for row, key in enumerate(keys):
+            self.index.setdefault(key, []).append(row)
+
+    def code(self, value):
+        value = "" if value is None else str(value)
+        if value not in self.codes:
+            self.codes[value] = len(self.strings)
+            self.strings.append(value)
+            temporary = self.dictionary_path + ".tmp"
+            with open(temporary, "w") as f:
+                json.dump(self.strings, f)
+            os.replace(temporary, self.dictionary_path)
+        return self.codes[value]
+
+    def append(self, record, function=None, source=None):
+        """Append a parsed wrk2 record; returns its row number."""
+        row = flatten(record)
+        row['function'] = function if function is not None else record.get('function')
+        row['source'] = source
+        row['timestamp'] = record.get('timestamp') or time.time()
+        values = {}
+        for name in STRING_COLUMNS:
+            values[name] = np.array([self.code(row[name])], dtype=np.int32)
+        for name in NUMBER_COLUMNS:
+            value = row[name]
+            values[name] = np.array([np.nan if value is None else value], dtype=np.float64)
+        for name, value in values.items():
+            with open(self.path(name), "ab") as f:
+                value.tofile(f)
+            self.columns[name] = np.concatenate([self.columns[name], value])
+        self.rows += 1
+        key = tuple(self.column(name)[-1] for name in INDEX_COLUMNS)
+        self.index.setdefault(key, []).append(self.rows - 1)
+        return self.rows - 1
+
+    def column(self, name, rows=None):
+        """A column as an array; string columns are decoded to a list."""
+        values = self.columns[name] if rows is None else self.columns[name][rows]
+        if name in STRING_COLUMNS:
+            return [self.strings[code] for code in values]
+        return values
+
+    def select(self, function=None, rate=None, threads=None, connections=None, valid=None):
+        """Row numbers matching every given key, in append order."""
+        wanted = (function, rate, threads, connections)
+        rows = []
+        for key, key_rows in self.index.items():
+            if all(w is None or w == k for w, k in zip(wanted, key)):
+                rows.extend(key_rows)
+        rows = np.array(sorted(rows), dtype=np.int64)
+        if valid is not None and len(rows):
+            rows = rows[(self.columns['valid'][rows] == 1.0) == valid]
+        return rows
+
+    def records(self, rows):
+        names = STRING_COLUMNS + NUMBER_COLUMNS
+        columns = {name: self.column(name, rows) for name in names}
+        result = []
+        for i in range(len(rows)):
+            record = {}
+            for name in names:
+                value = columns[name][i]
+                if name not in STRING_COLUMNS:
+                    value = None if math.isnan(value) else float(value)
+                record[name] = value
+            record['valid'] = record['valid'] == 1.0
+            result.append(record)
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse wrk2 output and keep the runs in a results store.")
+    parser.add_argument("--store", default="wrk2-results", help="results store directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    parse = commands.add_parser("parse", help="print the record of a wrk2 output file")
+    parse.add_argument("file")
+    parse.add_argument("--rate", type=float, help="target rate (-R) of the run")
+    ingest = commands.add_parser("ingest", help="parse wrk2 output files and append them to the store")
+    ingest.add_argument("files", nargs="+")
+    ingest.add_argument("--function", required=True)
+    ingest.add_argument("--rate", type=float, help="target rate (-R) of the runs")
+    show = commands.add_parser("show", help="print stored runs as JSON lines")
+    show.add_argument("--function")
+    show.add_argument("--rate", type=float)
+    show.add_argument("--threads", type=int)
+    show.add_argument("--connections", type=int)
+    show.add_argument("--invalid", action="store_true", help="only the invalid runs")
+    args = parser.parse_args()
+
+    if args.command == "parse":
+        with open(args.file) as f:
+            print(json.dumps(parse_wrk2(f.read(), args.rate), indent=2))
+        return
+
+    store = ResultStore(args.store)
+    if args.command == "ingest":
+        for path in args.files:
+            with open(path) as f:
+                record = parse_wrk2(f.read(), args.rate)
+            row = store.append(record, function=args.function, source=os.path.abspath(path))
+            status = "valid" if record['valid'] else "INVALID: " + "; ".join(record['invalid_reasons'])
+            print("row %d %s %s" % (row, path, status), file=sys.stderr)
+    else:
+        rows = store.select(args.function, args.rate, args.threads, args.connections,
+                            valid=False if args.invalid else None)
+        for record in store.records(rows):
+            print(json.dumps(record))
+
+
+if __name__ == "__main__":
+    main()